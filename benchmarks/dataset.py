@@ -0,0 +1,54 @@
+import json
+import random
+from pathlib import Path
+
+from utils.Deck import encodeCardIds
+
+
+def generateCards(count: int, rng: random.Random) -> list[dict]:
+    return [
+        {
+            "id": i,
+            "name": f"Card {i}",
+            "link": f"https://example.com/cards/{i}.jpg",
+            "props": {"atk": rng.randint(0, 100), "def": rng.randint(0, 100)}
+        }
+        for i in range(count)
+    ]
+
+
+def generatePlayer(playerId: int, cardCount: int, rng: random.Random) -> dict:
+    # a few decks of a typical size, and a hand of a handful of cards
+    decks = [
+        {
+            "name": f"Deck {d}",
+            "cards": encodeCardIds([rng.randrange(cardCount) for _ in range(rng.randint(20, 60))])
+        }
+        for d in range(rng.randint(1, 3))
+    ]
+    return {
+        "username": f"player{playerId}",
+        "id": playerId,
+        "hand": encodeCardIds([rng.randrange(cardCount) for _ in range(rng.randint(0, 7))]),
+        "decks": decks,
+        "activeDeck": decks[0]["name"]
+    }
+
+
+def writeDataset(root: Path, players: int, cards: int = 200, seed: int = 0) -> Path:
+    # writes data/players.json and assets/cards/cards.json under root, the layout Database expects;
+    # the same arguments always produce the same files, so runs on different commits are comparable
+    rng = random.Random(seed)
+    (root / "data").mkdir(parents=True, exist_ok=True)
+    (root / "assets" / "cards").mkdir(parents=True, exist_ok=True)
+    with open(root / "assets" / "cards" / "cards.json", "w") as file:
+        json.dump({"cards": generateCards(cards, rng)}, file)
+    with open(root / "data" / "players.json", "w") as file:
+        # written one player at a time, so that a million players don't have to fit in memory twice
+        file.write('{"players":[')
+        for playerId in range(players):
+            if playerId:
+                file.write(",")
+            json.dump(generatePlayer(playerId, cards, rng), file)
+        file.write("]}")
+    return root
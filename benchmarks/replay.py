@@ -0,0 +1,237 @@
+import argparse
+import asyncio
+import importlib
+import json
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.dataset import writeDataset
+from benchmarks.run import percentile
+from utils.db import Database
+from utils.log import Logger
+from utils.pages import CardPages
+from utils.partitions import GuildPartitions
+
+# commands that can be replayed; rm and restart would wipe the data other simulated users are working on
+replayableCommands = [
+    "whoAmI", "decks", "newDeck", "removeDeck", "showAllCards", "addCardToDeck", "addCardToOtherDeck", "draw", "play",
+    "setCurrentDeck"
+]
+
+
+class FakeAvatar:
+    def __init__(self, userId: int):
+        self.url = f"https://cdn.discordapp.com/avatars/{userId}.png"
+
+
+class FakeRole:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMember:
+    def __init__(self, userId: int, name: str, roles: list[str] | None = None):
+        self.id = userId
+        self.name = name
+        self.bot = False
+        self.avatar = FakeAvatar(userId)
+        self.roles = [FakeRole(role) for role in (roles if roles else ["@everyone"])]
+
+
+class FakeChannel:
+    def __init__(self, channelId: int, name: str):
+        self.id = channelId
+        self.name = name
+
+
+class FakeGuild:
+    def __init__(self, guildId: int):
+        self.id = guildId
+
+
+class FakeMessage:
+    def __init__(self, messageId: int, content: str, author: FakeMember, channel: FakeChannel, guild: FakeGuild):
+        self.id = messageId
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = guild
+
+
+class FakeContext:
+    # stands in for discord.ext.commands.Context; whatever the handlers send is kept in self.sent
+    def __init__(self, message: FakeMessage):
+        self.message = message
+        self.author = message.author
+        self.channel = message.channel
+        self.guild = message.guild
+        self.sent: list[dict] = []
+
+    async def send(self, content=None, embed=None, **kwargs):
+        self.sent.append({"content": content, "embed": embed.to_dict() if embed is not None else None})
+
+
+def syntheticStream(users: int, commandsPerUser: int, cardNames: list[str], seed: int = 0) -> list[dict]:
+    # every user registers, builds and activates a deck, and then plays around with it
+    rng = random.Random(seed)
+    stream = []
+    for userId in range(1, users + 1):
+        commands = [
+            ["whoAmI"],
+            ["newDeck", "main"],
+            *[["addCardToDeck", rng.choice(cardNames), "main"] for _ in range(5)],
+            ["setCurrentDeck", "main"]
+        ]
+        while len(commands) < commandsPerUser:
+            commands.append(rng.choice([
+                ["draw", "1"], ["draw", "1"], ["play", "$hand"], ["addCardToDeck", rng.choice(cardNames), "main"],
+                ["decks"], ["whoAmI"], ["showAllCards"]
+            ]))
+        stream.extend({"user": userId, "command": c[0], "args": c[1:]} for c in commands[:max(commandsPerUser, 1)])
+    return stream
+
+
+class Replayer:
+    def __init__(self, module, db: Database | GuildPartitions, guilds: int = 1):
+        self.module = module
+        self.db = db
+        # users are spread over the simulated guilds by id
+        self.guilds = [FakeGuild(guildId) for guildId in range(1, guilds + 1)]
+        self.channel = FakeChannel(1, "load-test")
+        self.messageId = 0
+        self.latencies: dict[str, list[int]] = {}
+        self.errors: dict[str, int] = {}
+
+    def member(self, userId: int) -> FakeMember:
+        return FakeMember(userId, f"user{userId}")
+
+    def guildOf(self, userId: int) -> FakeGuild:
+        return self.guilds[userId % len(self.guilds)]
+
+    def database(self, userId: int) -> Database:
+        if isinstance(self.db, GuildPartitions):
+            return self.db.partition(self.guildOf(userId).id)
+        return self.db
+
+    def resolveArgs(self, userId: int, args: list[str]) -> list[str]:
+        # "$hand" stands for the first card in the user's hand at the moment the command runs
+        resolved = []
+        for arg in args:
+            if arg == "$hand":
+                try:
+                    hand = self.database(userId).findPlayer(userId).hand
+                except Exception:
+                    hand = []
+                arg = self.database(userId).catalog.nameOf(hand[0]) if len(hand) else "nothing"
+            resolved.append(arg)
+        return resolved
+
+    async def invoke(self, entry: dict):
+        name = entry["command"]
+        args = self.resolveArgs(entry["user"], entry.get("args", []))
+        self.messageId += 1
+        message = FakeMessage(
+            self.messageId, " ".join([f"/{name}", *args]), self.member(entry["user"]), self.channel,
+            self.guildOf(entry["user"])
+        )
+        ctx = FakeContext(message)
+        start = time.perf_counter_ns()
+        try:
+            await getattr(self.module, name)(ctx, *args)
+        except Exception:
+            # the handlers report user errors by raising, after having sent their error embed
+            self.errors[name] = self.errors.get(name, 0) + 1
+        self.latencies.setdefault(name, []).append(time.perf_counter_ns() - start)
+
+    async def replay(self, stream: list[dict], concurrency: int) -> float:
+        # commands of one user run in order, and up to `concurrency` users run at the same time
+        perUser: dict[int, list[dict]] = {}
+        for entry in stream:
+            perUser.setdefault(entry["user"], []).append(entry)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def runUser(entries: list[dict]):
+            async with semaphore:
+                for entry in entries:
+                    await self.invoke(entry)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(runUser(entries) for entries in perUser.values()))
+        return time.perf_counter() - start
+
+    def report(self, elapsed: float) -> dict:
+        commands = {}
+        for name, latencies in sorted(self.latencies.items()):
+            commands[name] = {
+                "count": len(latencies),
+                "errors": self.errors.get(name, 0),
+                "p50Ms": percentile(latencies, 50) / 1e6,
+                "p95Ms": percentile(latencies, 95) / 1e6,
+                "p99Ms": percentile(latencies, 99) / 1e6,
+                "maxMs": max(latencies) / 1e6,
+                "meanMs": statistics.fmean(latencies) / 1e6
+            }
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        return {"commands": total, "seconds": elapsed, "commandsPerSecond": total / elapsed, "perCommand": commands}
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.replay",
+                                     description="Replays command streams against the bot's handlers offline")
+    parser.add_argument("--module", default="main", choices=["main", "mainButIntents"])
+    parser.add_argument("--backend", default="json", choices=["json", "sharded", "sqlite"])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--commands-per-user", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--guilds", type=int, default=1, help="number of simulated guilds the users are spread over")
+    parser.add_argument("--partitioned", action="store_true", help="give every simulated guild its own storage")
+    parser.add_argument("--stream", type=Path, help="json lines file of {user, command, args} to replay")
+    parser.add_argument("--record", type=Path, help="write the synthetic stream here, to replay it later")
+    parser.add_argument("--output", type=Path, help="where to write the json report (stdout by default)")
+    args = parser.parse_args(argv)
+
+    module = importlib.import_module(args.module)
+    with tempfile.TemporaryDirectory() as directory:
+        # the bot's own db and logger are swapped for ones on an empty dataset
+        root = writeDataset(Path(directory), players=0, seed=args.seed)
+        module.db.close()
+        module.logger.close()
+        module.db = GuildPartitions(str(root / "replay.py"), backend=args.backend) if args.partitioned \
+            else Database(str(root / "replay.py"), backend=args.backend)
+        module.logger = Logger(str(root / "replay.py"))
+        module.cardPages = CardPages(module.db.catalog)
+
+        if args.stream:
+            with open(args.stream, "r") as file:
+                stream = [json.loads(line) for line in file if line.strip()]
+        else:
+            cardNames = [card.name for card in module.db.catalog.all()]
+            stream = syntheticStream(args.users, args.commands_per_user, cardNames, args.seed)
+        if args.record:
+            with open(args.record, "w") as file:
+                file.writelines(json.dumps(entry) + "\n" for entry in stream)
+
+        replayer = Replayer(module, module.db, args.guilds)
+        elapsed = asyncio.run(replayer.replay(stream, args.concurrency))
+        module.db.close()
+        module.logger.close()
+
+    report = {"module": args.module, "backend": args.backend, "concurrency": args.concurrency, "guilds": args.guilds,
+              "partitioned": args.partitioned,
+              **replayer.report(elapsed)}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
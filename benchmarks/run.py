@@ -0,0 +1,169 @@
+import argparse
+import json
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from benchmarks.dataset import writeDataset
+from utils.db import Database, helperUser
+from utils.log import Logger
+
+# how many iterations of each operation are repeated under tracemalloc to find its peak memory
+memoryIterations = 100
+
+
+def percentile(values: list[int], q: float) -> float:
+    return statistics.quantiles(values, n=100, method="inclusive")[int(q) - 1] if len(values) > 1 else values[0]
+
+
+def measure(name: str, operation, iterations: int) -> dict:
+    latencies = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        before = time.perf_counter_ns()
+        operation(i)
+        latencies.append(time.perf_counter_ns() - before)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    for i in range(min(iterations, memoryIterations)):
+        operation(iterations + i)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "operation": name,
+        "iterations": iterations,
+        "throughputPerSecond": iterations / elapsed,
+        "p50Ms": percentile(latencies, 50) / 1e6,
+        "p99Ms": percentile(latencies, 99) / 1e6,
+        "meanMs": statistics.fmean(latencies) / 1e6,
+        "peakMemoryBytes": peak
+    }
+
+
+def benchmarkDatabase(root: Path, players: int, backend: str, iterations: int, seed: int) -> list[dict]:
+    rng = random.Random(seed)
+    results = []
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    # the background flush is pushed far out, so that only explicit flushes are measured
+    db = Database(str(root / "bench.py"), backend=backend, flushInterval=3600)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    results.append({"operation": "Database.__init__", "iterations": 1, "seconds": elapsed, "peakMemoryBytes": peak})
+
+    ids = [rng.randrange(players) for _ in range(iterations + memoryIterations)]
+    results.append(measure("Database.findPlayer", lambda i: db.findPlayer(ids[i]), iterations))
+
+    loaded = [db.findPlayer(playerId) for playerId in ids]
+    results.append(measure("Database.savePlayer", lambda i: db.savePlayer(loaded[i]), iterations))
+    results.append(measure(
+        "Database.createNewPlayer", lambda i: db.createNewPlayer(helperUser(f"new{i}", players + i)), iterations
+    ))
+
+    def flush(i):
+        db.savePlayer(loaded[i])
+        db.flush()
+
+    results.append(measure("Database.flush", flush, max(iterations // 100, 1)))
+
+    # every draw is undone by playing the same card, so decks never run out
+    def drawAndPlay(i, measurePlay: bool):
+        player = loaded[i % len(loaded)]
+        if measurePlay:
+            player.draw(1)
+            start = time.perf_counter_ns()
+            player.play(player.hand[-1])
+            return time.perf_counter_ns() - start
+        start = time.perf_counter_ns()
+        player.draw(1)
+        elapsed = time.perf_counter_ns() - start
+        player.play(player.hand[-1])
+        return elapsed
+
+    for name, measurePlay in (("Player.draw", False), ("Player.play", True)):
+        latencies = [drawAndPlay(i, measurePlay) for i in range(iterations)]
+        results.append({
+            "operation": name,
+            "iterations": iterations,
+            "throughputPerSecond": 1e9 / statistics.fmean(latencies),
+            "p50Ms": percentile(latencies, 50) / 1e6,
+            "p99Ms": percentile(latencies, 99) / 1e6,
+            "meanMs": statistics.fmean(latencies) / 1e6
+        })
+
+    db.close()
+    return results
+
+
+def benchmarkLogger(root: Path, iterations: int) -> list[dict]:
+    logger = Logger(str(root / "bench.py"))
+    props = {"interaction": {"type": "context", "message": {"id": 1, "content": "/draw 1"}}, "success": True}
+    results = [measure("Logger.log", lambda i: logger.log("benchmark", props=props), iterations)]
+    start = time.perf_counter()
+    logger.close()
+    results.append({"operation": "Logger.close", "iterations": 1, "seconds": time.perf_counter() - start})
+    return results
+
+
+def gitCommit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=Path(__file__).parent
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(playerCounts: list[int], backends: list[str], iterations: int, seed: int) -> dict:
+    report = {
+        "commit": gitCommit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "seed": seed,
+        "iterations": iterations,
+        "runs": []
+    }
+    for players in playerCounts:
+        for backend in backends:
+            with tempfile.TemporaryDirectory() as directory:
+                root = writeDataset(Path(directory), players, seed=seed)
+                report["runs"].append({
+                    "players": players,
+                    "backend": backend,
+                    "operations": benchmarkDatabase(root, players, backend, iterations, seed)
+                })
+    with tempfile.TemporaryDirectory() as directory:
+        report["logger"] = benchmarkLogger(Path(directory), iterations)
+    # ru_maxrss is in kilobytes on linux
+    report["maxRssBytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return report
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmarks Database, Logger and Player")
+    parser.add_argument("--players", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="dataset sizes to run, up to 1000000")
+    parser.add_argument("--backends", nargs="+", default=["json", "sharded", "sqlite"],
+                        choices=["json", "sharded", "sqlite"])
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="where to write the json report (stdout by default)")
+    args = parser.parse_args(argv)
+
+    report = run(args.players, args.backends, args.iterations, args.seed)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
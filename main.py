@@ -1,4 +1,5 @@
 import os
+from pathlib import Path
 
 import discord
 from discord.ext import commands
@@ -6,138 +7,192 @@ from discord.ext.commands.context import Context  # for typing only
 from dotenv import load_dotenv
 
 # utilities
-from utils.db import Database, PlayerNotFound
+from utils.db import Database, Player, PlayerNotFound, unitOfWork
 from utils.Deck import Deck
 from utils.log import Logger
 from utils.Exceptions import BadRequest
+from utils.metrics import metrics
+from utils.partitions import GuildPartitions, guildScoped
+from utils.pages import CardPages, pagedEmbeds, sendPages
 
 load_dotenv()
 APIToken = os.getenv("botToken")
+storageBackend = os.getenv("storageBackend", "json")
+commitWindowMs = os.getenv("commitWindowMs", "5")
+commitBatchSize = int(os.getenv("commitBatchSize", "256"))
+logLevel = os.getenv("logLevel", "info")
+logSampleRate = float(os.getenv("logSampleRate", "1.0"))
+logSampleRates = Logger.parseSampleRates(os.getenv("logSampleRates", ""))
+shuffleMode = os.getenv("shuffleMode", "lazy")
+shuffleSeed = os.getenv("shuffleSeed")
+guildPartitions = os.getenv("guildPartitions", "off")
+partitionIdleMinutes = float(os.getenv("partitionIdleMinutes", "10"))
 
 intents = discord.Intents.default()
 intents.message_content = True
 bot = commands.Bot(command_prefix='/', intents=intents)
 
-logger = Logger(__file__)
-db = Database(__file__)
+logger = Logger(__file__, level=logLevel, sampleRate=logSampleRate, sampleRates=logSampleRates)
+databaseOptions = {
+    "backend": storageBackend,
+    "commitWindow": None if commitWindowMs == "off" else float(commitWindowMs) / 1000,
+    "commitBatchSize": commitBatchSize,
+    "shuffleMode": shuffleMode,
+    "shuffleSeed": int(shuffleSeed) if shuffleSeed else None
+}
+# with guild partitions, every server gets its own storage, opened when it is first used
+db = GuildPartitions(__file__, idleTimeout=partitionIdleMinutes * 60, **databaseOptions) \
+    if guildPartitions == "on" else Database(__file__, **databaseOptions)
+cardPages = CardPages(db.catalog)
+metrics.install(db, logger)
+metrics.startExporter(Path(logger.folderPath) / "metrics.prom")
 
 
 async def handlePlayerExists(ctx: Context) -> bool:
     try:
-        db.findPlayer(ctx.message.author.id)
-        logger.log("handlePlayerExists called", props={
+        player = await db.loadPlayer(ctx.message.author.id)
+        if player.username != ctx.message.author.name:
+            # keeps lookups by name pointing at people who renamed themselves
+            async with db.transaction(ctx.message.author.id) as player:
+                player.username = ctx.message.author.name
+        logger.log("handlePlayerExists called", props=lambda: {
             "interaction": Logger.contextToObject(ctx),
             "success": True
-        })
+        }, level="debug")
         return True
     except PlayerNotFound:
-        logger.log("handlePlayerExists called", props={
+        logger.log("handlePlayerExists called", props=lambda: {
             "interaction": Logger.contextToObject(ctx),
             "success": False
-        })
+        }, level="debug")
         embed = discord.Embed(
             title='Uh Oh! An error occurred!',
             description='Player not found! Creating a new player... If this happened through a command, please re-run '
                         'it.',
             color=0xff0000)
         await ctx.send(embed=embed)
-        db.createNewPlayer(ctx.message.author)
+        await db.createPlayer(ctx.message.author)
         return False
 
 
+async def findOtherPlayer(ctx: Context, command: str, otherName: str, props: dict) -> Player:
+    try:
+        return await db.findPlayerFromNameAsync(otherName)
+    except PlayerNotFound:
+        embed = discord.Embed(title=command, description=f"There is no player called {otherName}!", color=0xff0000)
+        await ctx.send(embed=embed)
+        logger.log(f"{command} called but the other player does not exist", props=lambda: {
+            "interaction": Logger.contextToObject(ctx), **props, "success": False
+        }, level="warning")
+        raise BadRequest(f"There is no player called {otherName}!")
+
+
 @bot.event
 async def on_ready():
     logger.log("bot ready!")
+    if isinstance(db, GuildPartitions):
+        db.startEvictor()
     print(f'Logged in as {bot.user}')
 
 
 @bot.event
 async def on_message(message: discord.Message):
     if message.author == bot.user:
-        logger.log("Message arrived!", props={
+        logger.log("Message arrived!", props=lambda: {
             "payload": logger.messageToObject(message),
             "wasMe": True
-        })
+        }, level="debug")
         return
     if message.content.startswith(bot.command_prefix):
-        logger.log("Message arrived!", props={
+        logger.log("Message arrived!", props=lambda: {
             "payload": logger.messageToObject(message),
             "wasMe": False
-        })
+        }, level="debug")
         await bot.process_commands(message)
         return
 
 
 @bot.command(name="whoAmI", description="Gives your stats")
+@metrics.instrumented
+@guildScoped
+@unitOfWork
 async def whoAmI(ctx: Context):
     if not await handlePlayerExists(ctx):
-        logger.log("whoAmI called", props={
+        logger.log("whoAmI called", props=lambda: {
             "interaction": Logger.contextToObject(ctx),
             "success": False
-        })
+        }, level="warning")
         return
-    player = db.findPlayer(ctx.message.author.id)
-    embed = discord.Embed(title='Found you!', description='', color=0x79e4ff)
-    for name in player.__dict__.keys():
-        embed.add_field(name=name, value=player.__dict__[name], inline=False)
-    await ctx.send(embed=embed)
-    logger.log("whoAmI called", props={
+    player = await db.loadPlayer(ctx.message.author.id)
+    fields = []
+    for name, value in db.describePlayer(player).items():
+        if name == "decks":
+            # one field per deck, so that players with many decks get more pages instead of a cut-off field
+            fields.extend((f'deck "{deck["name"]}"', ", ".join(deck["cards"]) or "empty") for deck in value)
+        else:
+            fields.append((name, value))
+    await sendPages(ctx, pagedEmbeds("Found you!", fields), ctx.message.author.id)
+    logger.log("whoAmI called", props=lambda: {
         "interaction": Logger.contextToObject(ctx),
         "success": True
     })
 
 
 @bot.command()
+@metrics.instrumented
+@guildScoped
+@unitOfWork
 async def decks(ctx: Context):
     try:
-        author = db.findPlayer(ctx.message.author.id)
+        author = await db.loadPlayer(ctx.message.author.id)
         embed = discord.Embed(title='Decks', description='Your current decks', color=0x79e4ff)
-        for deck in author.decks:
-            embed.add_field(name=f'"{deck.name}"', value=f'{len(deck.cards)} cards', inline=False)
+        for deck in author.decks.values():
+            embed.add_field(name=f'"{deck.name}"', value=f'{len(deck)} cards', inline=False)
         if not len(author.decks):
             embed = discord.Embed(title='Decks', description='You have no decks at the moment. Please consider '
                                                              'creating one with /newDeck', color=0x79e4ff)
         await ctx.send(embed=embed)
-        logger.log("decks called", props={
+        logger.log("decks called", props=lambda: {
             "interaction": Logger.contextToObject(ctx),
             "success": True
         })
     except PlayerNotFound:
-        logger.log("decks called", props={
+        logger.log("decks called", props=lambda: {
             "interaction": Logger.contextToObject(ctx),
             "success": False
-        })
+        }, level="warning")
         embed = discord.Embed(title='Decks', description='Player not found! Creating a new player...', color=0xff0000)
         await ctx.send(embed=embed)
-        db.createNewPlayer(ctx.message.author)
+        await db.createPlayer(ctx.message.author)
         await decks(ctx)
 
 
 @bot.command()
+@metrics.instrumented
+@guildScoped
+@unitOfWork
 async def newDeck(ctx: Context, name: str = None):
     if not await handlePlayerExists(ctx):
-        logger.log("newDeck called", props={
+        logger.log("newDeck called", props=lambda: {
             "interaction": Logger.contextToObject(ctx),
             "name": name,
             "success": False
-        })
+        }, level="warning")
         return
-    player = db.findPlayer(ctx.message.author.id)
-    for deck in player.decks:
-        if deck.name == name:
+    async with db.transaction(ctx.message.author.id) as player:
+        if player.getDeck(name) is not None:
             embed = discord.Embed(title='newDeck', description='Deck already exists! Please try another name',
                                   color=0xff0000)
             await ctx.send(embed=embed)
-            logger.log("newDeck called", props={
+            logger.log("newDeck called", props=lambda: {
                 "interaction": Logger.contextToObject(ctx),
                 "name": name,
                 "success": False
-            })
+            }, level="warning")
             raise BadRequest("Deck already exists!")
-    player.decks.append(Deck(name=name))
-    db.savePlayer(player)
+        player.addDeck(Deck(name=name))
     await decks(ctx)
-    logger.log("newDeck called", props={
+    logger.log("newDeck called", props=lambda: {
         "interaction": Logger.contextToObject(ctx),
         "name": name,
         "success": True
@@ -145,33 +200,30 @@ async def newDeck(ctx: Context, name: str = None):
 
 
 @bot.command()
+@metrics.instrumented
+@guildScoped
+@unitOfWork
 async def removeDeck(ctx: Context, name: str = None):
     if not await handlePlayerExists(ctx):
-        logger.log("removeDeck called", props={
+        logger.log("removeDeck called", props=lambda: {
             "interaction": Logger.contextToObject(ctx),
             "name": name,
             "success": False
-        })
+        }, level="warning")
         return
-    player = db.findPlayer(ctx.message.author.id)
-    found = False
-    for i, deck in enumerate(player.decks):
-        if deck.name == name:
-            player.decks.remove(deck)
-            found = True
-    if not found:
-        embed = discord.Embed(title='removeDeck', description="Deck doesn't exist! Please try another name",
-                              color=0xff0000)
-        await ctx.send(embed=embed)
-        logger.log("removeDeck called", props={
-            "interaction": Logger.contextToObject(ctx),
-            "name": name,
-            "success": False
-        })
-        raise BadRequest("Deck does not exist!")
-    db.savePlayer(player)
+    async with db.transaction(ctx.message.author.id) as player:
+        if not player.removeDeck(name):
+            embed = discord.Embed(title='removeDeck', description="Deck doesn't exist! Please try another name",
+                                  color=0xff0000)
+            await ctx.send(embed=embed)
+            logger.log("removeDeck called", props=lambda: {
+                "interaction": Logger.contextToObject(ctx),
+                "name": name,
+                "success": False
+            }, level="warning")
+            raise BadRequest("Deck does not exist!")
     await decks(ctx)
-    logger.log("removeDeck called", props={
+    logger.log("removeDeck called", props=lambda: {
         "interaction": Logger.contextToObject(ctx),
         "name": name,
         "success": True
@@ -179,82 +231,84 @@ async def removeDeck(ctx: Context, name: str = None):
 
 
 @bot.command()
+@metrics.instrumented
+@guildScoped
+@unitOfWork
 async def showAllCards(ctx: Context):
-    logger.log("showAllCards called", props={
+    logger.log("showAllCards called", props=lambda: {
         "interaction": Logger.contextToObject(ctx)
     })
-    embed = discord.Embed(title="All available cards!", color=0x79e4ff)
-    for c in db.getCards():
-        embed.add_field(name=c["name"], value=c["props"], inline=False)
-    await ctx.send(embed=embed)
+    await sendPages(ctx, cardPages.get(), ctx.message.author.id)
 
 
 @bot.command()
+@metrics.instrumented
+@guildScoped
+@unitOfWork
 async def addCardToDeck(ctx: Context, cardName: str, deckName: str):
     if not await handlePlayerExists(ctx):
-        logger.log("addCardToDeck called", props={
+        logger.log("addCardToDeck called", props=lambda: {
             "interaction": Logger.contextToObject(ctx),
             "cardName": cardName,
             "deckName": deckName,
             "success": False
-        })
+        }, level="warning")
         return
     if not db.isValidCardName(cardName):
         embed = discord.Embed(title='Add card to deck', description="Such card doesn't exist. Please use "
                                                                     "/showAllCards to see all of them", color=0xff0000)
         await ctx.send(embed=embed)
-        logger.log("addCardToDeck called", props={
+        logger.log("addCardToDeck called", props=lambda: {
             "interaction": Logger.contextToObject(ctx),
             "cardName": cardName,
             "deckName": deckName,
             "success": False
-        })
+        }, level="warning")
         raise BadRequest("There isn't a card called like that. Please use /showAllCards to see all of them.")
-    player = db.findPlayer(ctx.message.author.id)
-    deckIndex = -1
-    for i in range(len(player.decks)):
-        if player.decks[i].name == deckName:
-            deckIndex = i
-    if deckIndex == -1:
-        embed = discord.Embed(title='Add card to deck', description="Such deck doesn't exist. Please use "
-                                                                    "/whoAmI to see your decks", color=0xff0000)
-        await ctx.send(embed=embed)
-        logger.log("addCardToDeck called", props={
-            "interaction": Logger.contextToObject(ctx),
-            "cardName": cardName,
-            "deckName": deckName,
-            "success": False
-        })
-        raise BadRequest("There is no deck called like that!")
-    player.decks[deckIndex].cards.append(cardName)
-    db.savePlayer(player)
+    async with db.transaction(ctx.message.author.id) as player:
+        deck = player.getDeck(deckName)
+        if deck is None:
+            embed = discord.Embed(title='Add card to deck', description="Such deck doesn't exist. Please use "
+                                                                        "/whoAmI to see your decks", color=0xff0000)
+            await ctx.send(embed=embed)
+            logger.log("addCardToDeck called", props=lambda: {
+                "interaction": Logger.contextToObject(ctx),
+                "cardName": cardName,
+                "deckName": deckName,
+                "success": False
+            }, level="warning")
+            raise BadRequest("There is no deck called like that!")
+        deck.addCard(db.catalog.idOf(cardName))
     embed = discord.Embed(title="Card added!", color=0x79e4ff)
     await ctx.send(embed=embed)
-    logger.log("addCardToDeck called", props={
+    logger.log("addCardToDeck called", props=lambda: {
         "interaction": Logger.contextToObject(ctx),
         "cardName": cardName,
         "deckName": deckName,
-        "success": False
+        "success": True
     })
 
 
 @bot.command()
+@metrics.instrumented
+@guildScoped
+@unitOfWork
 async def addCardToOtherDeck(ctx: Context, cardName: str, otherName: str, deckName: str):
     if not await handlePlayerExists(ctx):
-        logger.log("addCardToOtherDeck called but player does not exist", props={
+        logger.log("addCardToOtherDeck called but player does not exist", props=lambda: {
             "interaction": Logger.contextToObject(ctx),
             "cardName": cardName,
             "deckName": deckName,
             "success": False
-        })
+        }, level="warning")
         return
     if not any(str(r) == "sudo-user" for r in ctx.message.author.roles):
-        logger.log("addCardToOtherDeck called but user isn't sudo user", props={
+        logger.log("addCardToOtherDeck called but user isn't sudo user", props=lambda: {
             "interaction": Logger.contextToObject(ctx),
             "cardName": cardName,
             "deckName": deckName,
             "success": False
-        })
+        }, level="warning")
         embed = discord.Embed(
             title='Uh Oh! An error occurred!',
             description="You don't seem to have the needed permissions!",
@@ -265,34 +319,35 @@ async def addCardToOtherDeck(ctx: Context, cardName: str, otherName: str, deckNa
         embed = discord.Embed(title='Add card to deck', description="Such card doesn't exist. Please use "
                                                                     "/showAllCards to see all of them", color=0xff0000)
         await ctx.send(embed=embed)
-        logger.log("addCardToOtherDeck called but card is not valid card name", props={
+        logger.log("addCardToOtherDeck called but card is not valid card name", props=lambda: {
             "interaction": Logger.contextToObject(ctx),
             "cardName": cardName,
             "deckName": deckName,
             "success": False
-        })
+        }, level="warning")
         raise BadRequest("There isn't a card called like that. Please use /showAllCards to see all of them.")
-    player = db.findPlayerFromName(otherName)
-    deckIndex = -1
-    for i in range(len(player.decks)):
-        if player.decks[i].name == deckName:
-            deckIndex = i
-    if deckIndex == -1:
-        embed = discord.Embed(title='Add card to deck', description="Such deck doesn't exist. Please use "
-                                                                    "/whoAmI to see your decks", color=0xff0000)
-        await ctx.send(embed=embed)
-        logger.log("addCardToDeck called but deck does not exist", props={
-            "interaction": Logger.contextToObject(ctx),
-            "cardName": cardName,
-            "deckName": deckName,
-            "success": False
-        })
-        raise BadRequest("There is no deck called like that!")
-    player.decks[deckIndex].cards.append(cardName)
-    db.savePlayer(player)
+    otherPlayer = await findOtherPlayer(ctx, "addCardToOtherDeck", otherName, {
+        "cardName": cardName,
+        "otherName": otherName,
+        "deckName": deckName
+    })
+    async with db.transaction(otherPlayer.id) as player:
+        deck = player.getDeck(deckName)
+        if deck is None:
+            embed = discord.Embed(title='Add card to deck', description="Such deck doesn't exist. Please use "
+                                                                        "/whoAmI to see your decks", color=0xff0000)
+            await ctx.send(embed=embed)
+            logger.log("addCardToDeck called but deck does not exist", props=lambda: {
+                "interaction": Logger.contextToObject(ctx),
+                "cardName": cardName,
+                "deckName": deckName,
+                "success": False
+            }, level="warning")
+            raise BadRequest("There is no deck called like that!")
+        deck.addCard(db.catalog.idOf(cardName))
     embed = discord.Embed(title="Card added!", color=0x79e4ff)
     await ctx.send(embed=embed)
-    logger.log("addCardToDeck called", props={
+    logger.log("addCardToDeck called", props=lambda: {
         "interaction": Logger.contextToObject(ctx),
         "cardName": cardName,
         "deckName": deckName,
@@ -301,104 +356,406 @@ async def addCardToOtherDeck(ctx: Context, cardName: str, otherName: str, deckNa
 
 
 @bot.command()
+@metrics.instrumented
+@guildScoped
+@unitOfWork
 async def draw(ctx: Context, n: str):
     if not await handlePlayerExists(ctx):
-        logger.log("draw called but user doesn't exist", props={
+        logger.log("draw called but user doesn't exist", props=lambda: {
             "interaction": Logger.contextToObject(ctx),
             "n": n,
             "success": False
-        })
+        }, level="warning")
         return
     try:
         int(n)
     except ValueError:
         embed = discord.Embed(title='Draw', description="Value inputted is not a number!", color=0xff0000)
         await ctx.send(embed=embed)
-        logger.log("draw called but input isn't a number", props={
+        logger.log("draw called but input isn't a number", props=lambda: {
             "interaction": Logger.contextToObject(ctx),
             "n": n,
             "success": False
-        })
+        }, level="warning")
         raise BadRequest("Value inputted is not a number!")
     num = int(n)
-    player = db.findPlayer(ctx.message.author.id)
-    db.savePlayer(player.draw(num))
+    if num < 1:
+        embed = discord.Embed(title='Draw', description="You have to draw at least one card!", color=0xff0000)
+        await ctx.send(embed=embed)
+        logger.log("draw called but input isn't positive", props=lambda: {
+            "interaction": Logger.contextToObject(ctx),
+            "n": n,
+            "success": False
+        }, level="warning")
+        raise BadRequest("You have to draw at least one card!")
+    async with db.transaction(ctx.message.author.id) as player:
+        player.draw(num, db.shuffler.streamFor(player))
     embed = discord.Embed(title="Card(s) drawn!", color=0x79e4ff)
     await ctx.send(embed=embed)
-    logger.log("draw called", props={
+    # the game and draw count are enough to recompute which cards this draw gave
+    logger.log("draw called", props=lambda: {
         "interaction": Logger.contextToObject(ctx),
         "n": n,
+        "game": db.shuffler.game,
+        "draw": player.draws,
         "success": True
     })
 
 
 @bot.command()
+@metrics.instrumented
+@guildScoped
+@unitOfWork
 async def play(ctx: Context, cardName: str):
     if not await handlePlayerExists(ctx):
-        logger.log("draw called but player does not exist", props={
+        logger.log("play called but player does not exist", props=lambda: {
             "interaction": Logger.contextToObject(ctx),
             "cardName": cardName,
             "success": False
-        })
+        }, level="warning")
         return
     if not db.isValidCardName(cardName):
         embed = discord.Embed(title='Play',
                               description="Card does not exist. Please try again",
                               color=0xff0000)
         await ctx.send(embed=embed)
-        logger.log("draw called but card does not exist", props={
+        logger.log("play called but card does not exist", props=lambda: {
             "interaction": Logger.contextToObject(ctx),
             "cardName": cardName,
             "success": False
-        })
+        }, level="warning")
         raise BadRequest("Card does not exist!")
-    player = db.findPlayer(ctx.message.author.id)
-    db.savePlayer(player.play(cardName))
+    async with db.transaction(ctx.message.author.id) as player:
+        player.play(db.catalog.idOf(cardName))
     embed = discord.Embed(title="Card played!", color=0x79e4ff)
     card = db.getCardFromName(cardName)
     embed.set_image(url=card.link)
     await ctx.send(embed=embed)
-    logger.log("draw called", props={
+    logger.log("play called", props=lambda: {
         "interaction": Logger.contextToObject(ctx),
         "cardName": cardName,
         "success": True
     })
 
 
+# batch commands take their cards as one comma separated list, e.g. "Assault, Assault, Heal"
+maxBatchSize = 100
+
+
+def splitCardNames(cardNames: str) -> list[str]:
+    return [name.strip() for name in cardNames.split(",") if name.strip()]
+
+
+async def rejectCardBatch(ctx: Context, command: str, description: str, props: dict):
+    embed = discord.Embed(title=command, description=description, color=0xff0000)
+    await ctx.send(embed=embed)
+    logger.log(f"{command} called but the cards are not valid", props=lambda: {
+        "interaction": Logger.contextToObject(ctx), **props, "success": False
+    }, level="warning")
+    raise BadRequest(description)
+
+
+async def validateCardBatch(ctx: Context, command: str, names: list[str], props: dict) -> list[int]:
+    # the size is checked first, so an oversized batch is turned down without looking at its cards
+    if not names or len(names) > maxBatchSize:
+        await rejectCardBatch(ctx, command, f"Please give between 1 and {maxBatchSize} cards", props)
+    cardIds, unknown = db.cardIdsFromNames(names)
+    if unknown:
+        await rejectCardBatch(ctx, command, f"These cards don't exist: {', '.join(unknown)}. "
+                                            f"Please use /showAllCards to see all of them", props)
+    return cardIds
+
+
+async def addCardIdsToDeck(ctx: Context, command: str, playerId: int, deckName: str, cardIds: list[int],
+                           props: dict):
+    # the whole batch is one load, one save and one log record
+    async with db.transaction(playerId) as player:
+        deck = player.getDeck(deckName)
+        if deck is None:
+            embed = discord.Embed(title=command, description="Such deck doesn't exist. Please use "
+                                                             "/whoAmI to see your decks", color=0xff0000)
+            await ctx.send(embed=embed)
+            logger.log(f"{command} called but deck does not exist", props=lambda: {
+                "interaction": Logger.contextToObject(ctx), **props, "success": False
+            }, level="warning")
+            raise BadRequest("There is no deck called like that!")
+        deck.addCards(cardIds)
+    embed = discord.Embed(title=f"{len(cardIds)} card(s) added!", color=0x79e4ff)
+    await ctx.send(embed=embed)
+    logger.log(f"{command} called", props=lambda: {
+        "interaction": Logger.contextToObject(ctx), **props, "success": True
+    })
+
+
+@bot.command()
+@metrics.instrumented
+@guildScoped
+@unitOfWork
+async def addCardsToDeck(ctx: Context, deckName: str, *, cardNames: str):
+    names = splitCardNames(cardNames)
+    props = {"cardNames": names, "deckName": deckName}
+    cardIds = await validateCardBatch(ctx, "addCardsToDeck", names, props)
+    try:
+        await addCardIdsToDeck(ctx, "addCardsToDeck", ctx.message.author.id, deckName, cardIds, props)
+    except PlayerNotFound:
+        await handlePlayerExists(ctx)
+
+
+@bot.command()
+@metrics.instrumented
+@guildScoped
+@unitOfWork
+async def addCopiesToDeck(ctx: Context, cardName: str, n: str, deckName: str):
+    props = {"cardName": cardName, "n": n, "deckName": deckName}
+    try:
+        count = int(n)
+    except ValueError:
+        embed = discord.Embed(title='addCopiesToDeck', description="Value inputted is not a number!", color=0xff0000)
+        await ctx.send(embed=embed)
+        logger.log("addCopiesToDeck called but input isn't a number", props=lambda: {
+            "interaction": Logger.contextToObject(ctx), **props, "success": False
+        }, level="warning")
+        raise BadRequest("Value inputted is not a number!")
+    if count < 1 or count > maxBatchSize:
+        await rejectCardBatch(ctx, "addCopiesToDeck", f"Please give between 1 and {maxBatchSize} cards", props)
+    cardIds = await validateCardBatch(ctx, "addCopiesToDeck", [cardName], props) * count
+    try:
+        await addCardIdsToDeck(ctx, "addCopiesToDeck", ctx.message.author.id, deckName, cardIds, props)
+    except PlayerNotFound:
+        await handlePlayerExists(ctx)
+
+
+@bot.command()
+@metrics.instrumented
+@guildScoped
+@unitOfWork
+async def addCardsToOtherDeck(ctx: Context, otherName: str, deckName: str, *, cardNames: str):
+    names = splitCardNames(cardNames)
+    props = {"cardNames": names, "otherName": otherName, "deckName": deckName}
+    if not any(str(r) == "sudo-user" for r in ctx.message.author.roles):
+        embed = discord.Embed(
+            title='Uh Oh! An error occurred!',
+            description="You don't seem to have the needed permissions!",
+            color=0xff0000)
+        await ctx.send(embed=embed)
+        logger.log("addCardsToOtherDeck called but user isn't sudo user", props=lambda: {
+            "interaction": Logger.contextToObject(ctx), **props, "success": False
+        }, level="warning")
+        return
+    cardIds = await validateCardBatch(ctx, "addCardsToOtherDeck", names, props)
+    otherPlayer = await findOtherPlayer(ctx, "addCardsToOtherDeck", otherName, props)
+    await addCardIdsToDeck(ctx, "addCardsToOtherDeck", otherPlayer.id, deckName, cardIds, props)
+
+
+@bot.command()
+@metrics.instrumented
+@guildScoped
+@unitOfWork
+async def playCards(ctx: Context, *, cardNames: str):
+    names = splitCardNames(cardNames)
+    props = {"cardNames": names}
+    cardIds = await validateCardBatch(ctx, "playCards", names, props)
+    try:
+        async with db.transaction(ctx.message.author.id) as player:
+            player.playMany(cardIds)
+    except PlayerNotFound:
+        await handlePlayerExists(ctx)
+        return
+    except BadRequest as error:
+        embed = discord.Embed(title='Play', description=str(error), color=0xff0000)
+        await ctx.send(embed=embed)
+        logger.log("playCards called but the cards can't be played", props=lambda: {
+            "interaction": Logger.contextToObject(ctx), **props, "success": False
+        }, level="warning")
+        raise
+    embed = discord.Embed(title="Cards played!", description=", ".join(names), color=0x79e4ff)
+    embed.set_image(url=db.getCardFromName(names[-1]).link)
+    await ctx.send(embed=embed)
+    logger.log("playCards called", props=lambda: {
+        "interaction": Logger.contextToObject(ctx), **props, "success": True
+    })
+
+
 @bot.command()
+@metrics.instrumented
+@guildScoped
+@unitOfWork
 async def setCurrentDeck(ctx: Context, deckName: str):
     if not await handlePlayerExists(ctx):
-        logger.log("setCurrentDeck called but player does not exist", props={
+        logger.log("setCurrentDeck called but player does not exist", props=lambda: {
             "interaction": Logger.contextToObject(ctx),
             "deckName": deckName,
             "success": False
-        })
+        }, level="warning")
         return
-    player = db.findPlayer(ctx.message.author.id)
-    if any(deck.name == deckName for deck in player.decks):
-        logger.log("setCurrentDeck called", props={
+    async with db.transaction(ctx.message.author.id) as player:
+        found = player.setActiveDeck(deckName)
+    if found:
+        logger.log("setCurrentDeck called", props=lambda: {
             "interaction": Logger.contextToObject(ctx),
             "deckName": deckName,
             "success": True
         })
-        player.activeDeck = deckName
-        db.savePlayer(player)
         embed = discord.Embed(title=f"Active deck changed to {deckName}", color=0x79e4ff)
         await ctx.send(embed=embed)
         return
-    logger.log("setCurrentDeck called but deck does not exist", props={
+    logger.log("setCurrentDeck called but deck does not exist", props=lambda: {
         "interaction": Logger.contextToObject(ctx),
         "deckName": deckName,
         "success": False
-    })
+    }, level="warning")
     return
 
 
+async def cardQueryTarget(ctx: Context, command: str, cardName: str) -> int | None:
+    # the card questions below are for sudo-users only, and need a card that exists
+    props = {"cardName": cardName}
+    if not any(str(r) == "sudo-user" for r in ctx.message.author.roles):
+        embed = discord.Embed(
+            title='Uh Oh! An error occurred!',
+            description="You don't seem to have the needed permissions!",
+            color=0xff0000)
+        await ctx.send(embed=embed)
+        logger.log(f"{command} called but user isn't sudo user", props=lambda: {
+            "interaction": Logger.contextToObject(ctx), **props, "success": False
+        }, level="warning")
+        return None
+    if not db.isValidCardName(cardName):
+        embed = discord.Embed(title=command, description="Such card doesn't exist. Please use "
+                                                         "/showAllCards to see all of them", color=0xff0000)
+        await ctx.send(embed=embed)
+        logger.log(f"{command} called but card is not valid card name", props=lambda: {
+            "interaction": Logger.contextToObject(ctx), **props, "success": False
+        }, level="warning")
+        return None
+    return db.catalog.idOf(cardName)
+
+
+@bot.command()
+@metrics.instrumented
+@guildScoped
+@unitOfWork
+async def cardOwners(ctx: Context, cardName: str):
+    cardId = await cardQueryTarget(ctx, "cardOwners", cardName)
+    if cardId is None:
+        return
+    owners = await db.runInExecutor(db.ownership.owners, cardId)
+    fields = [(username, f"{count} copies") for username, count in owners]
+    await sendPages(ctx, pagedEmbeds(f"Who owns {cardName}", fields, description="" if fields else "Nobody!"),
+                    ctx.message.author.id)
+    logger.log("cardOwners called", props=lambda: {
+        "interaction": Logger.contextToObject(ctx), "cardName": cardName, "success": True
+    })
+
+
+@bot.command()
+@metrics.instrumented
+@guildScoped
+@unitOfWork
+async def cardCopies(ctx: Context, cardName: str):
+    cardId = await cardQueryTarget(ctx, "cardCopies", cardName)
+    if cardId is None:
+        return
+    total, inHands, inDecks = await db.runInExecutor(db.ownership.copies, cardId)
+    embed = discord.Embed(title=f"Copies of {cardName}", description=f"{total} in circulation", color=0x79e4ff)
+    embed.add_field(name="In hands", value=inHands)
+    embed.add_field(name="In decks", value=inDecks)
+    await ctx.send(embed=embed)
+    logger.log("cardCopies called", props=lambda: {
+        "interaction": Logger.contextToObject(ctx), "cardName": cardName, "success": True
+    })
+
+
+@bot.command()
+@metrics.instrumented
+@guildScoped
+@unitOfWork
+async def decksBuiltAround(ctx: Context, cardName: str):
+    cardId = await cardQueryTarget(ctx, "decksBuiltAround", cardName)
+    if cardId is None:
+        return
+    decks = await db.runInExecutor(db.ownership.decksBuiltAround, cardId)
+    fields = [(f'{username}: "{deckName}"', f"{count} copies, {share:.0%} of the deck")
+              for username, deckName, count, share in decks]
+    await sendPages(ctx, pagedEmbeds(f"Decks built around {cardName}", fields,
+                                     description="" if fields else "No deck has it!"), ctx.message.author.id)
+    logger.log("decksBuiltAround called", props=lambda: {
+        "interaction": Logger.contextToObject(ctx), "cardName": cardName, "success": True
+    })
+
+
+@bot.command()
+@metrics.instrumented
+@guildScoped
+@unitOfWork
+async def stats(ctx: Context):
+    if not any(str(r) == "sudo-user" for r in ctx.message.author.roles):
+        logger.log("stats called but user isn't sudo user", props=lambda: {
+            "interaction": Logger.contextToObject(ctx),
+            "success": False
+        }, level="warning")
+        embed = discord.Embed(
+            title='Uh Oh! An error occurred!',
+            description="You don't seem to have the needed permissions!",
+            color=0xff0000)
+        await ctx.send(embed=embed)
+        return
+    embed = discord.Embed(title="Command stats", description="Latency per command, since the bot started",
+                          color=0x79e4ff)
+    for name, value in metrics.summary()[:25]:
+        embed.add_field(name=name, value=value, inline=False)
+    await ctx.send(embed=embed)
+    logger.log("stats called", props=lambda: {
+        "interaction": Logger.contextToObject(ctx),
+        "success": True
+    })
+
+
+@bot.command()
+@metrics.instrumented
+@guildScoped
+@unitOfWork
+async def shuffleAll(ctx: Context, seed: str = None):
+    if not any(str(r) == "sudo-user" for r in ctx.message.author.roles):
+        logger.log("shuffleAll called but user isn't sudo user", props=lambda: {
+            "interaction": Logger.contextToObject(ctx),
+            "success": False
+        }, level="warning")
+        embed = discord.Embed(
+            title='Uh Oh! An error occurred!',
+            description="You don't seem to have the needed permissions!",
+            color=0xff0000)
+        await ctx.send(embed=embed)
+        return
+    if seed is not None and not seed.isdigit():
+        embed = discord.Embed(title='Shuffle all', description="Seed inputted is not a number!", color=0xff0000)
+        await ctx.send(embed=embed)
+        logger.log("shuffleAll called but seed isn't a number", props=lambda: {
+            "interaction": Logger.contextToObject(ctx),
+            "seed": seed,
+            "success": False
+        }, level="warning")
+        return
+    players, decks = await db.shuffleAllDecksAsync(int(seed) if seed is not None else None)
+    embed = discord.Embed(title="All decks shuffled!", description=f"{decks} decks of {players} players, "
+                                                                   f"game {db.shuffler.game}", color=0x79e4ff)
+    await ctx.send(embed=embed)
+    logger.log("shuffleAll called", props=lambda: {
+        "interaction": Logger.contextToObject(ctx),
+        "game": db.shuffler.game,
+        "seed": db.shuffler.seed,
+        "success": True
+    })
+
+
 @bot.command()
+@metrics.instrumented
+@guildScoped
+@unitOfWork
 async def rm(ctx: Context):
-    db.deleteAllData()
+    await db.deleteAllDataAsync()
     await ctx.send("Done!")
-    logger.log("rm called", props={
+    logger.log("rm called", props=lambda: {
         "interaction": Logger.contextToObject(ctx),
         "success": True
     })
@@ -406,16 +763,22 @@ async def rm(ctx: Context):
 
 
 @bot.command()
+@metrics.instrumented
+@guildScoped
+@unitOfWork
 async def restart(ctx: Context):
-    db.restart()
+    await db.restartAsync()
     await ctx.send("Restarted!")
-    logger.log("restart called", props={
+    logger.log("restart called", props=lambda: {
         "interaction": Logger.contextToObject(ctx),
         "success": True
     })
 
 
 @bot.command()
+@metrics.instrumented
+@guildScoped
+@unitOfWork
 async def commands(ctx: Context):
     await ctx.send("""
 Welcome! Here is a list of my commands...
@@ -435,8 +798,26 @@ Welcome! Here is a list of my commands...
     + Adds a card `card` to the deck `deck`.
 + **addCardToOtherDeck** `[card]` `[name]` `[deck]`
     + Adds a card `card` to `name`'s deck `deck`
++ **addCardsToDeck `[deck]` `[card, card, ...]`**
+    + Adds several cards, separated by commas, to one of your decks at once.
++ **addCopiesToDeck `[card]` `[n]` `[deck]`**
+    + Adds n copies of a card to one of your decks.
++ **addCardsToOtherDeck `[name]` `[deck]` `[card, card, ...]`**
+    + Adds several cards to someone else's deck (sudo-user only).
 + **draw `[n]`**
     + Draws `n` cards.
++ **playCards `[card, card, ...]`**
+    + Plays several cards from your hand at once.
++ **cardOwners `[card]`**
+    + Lists who owns a card, and how many copies (sudo-user only).
++ **cardCopies `[card]`**
+    + Counts the copies of a card in hands and decks (sudo-user only).
++ **decksBuiltAround `[card]`**
+    + Lists the decks where a card makes up the biggest share (sudo-user only).
++ **stats**
+    + Shows how long each command takes (sudo-user only).
++ **shuffleAll `[seed]`**
+    + Starts a new game with every deck shuffled, optionally from a given seed (sudo-user only).
 + **rm**
     + Deletes all user data (testing only).
 + **restart**
@@ -444,7 +825,7 @@ Welcome! Here is a list of my commands...
 + **commands**
     + Returns a list of the bot's commands
     """)
-    logger.log("commands called", props={
+    logger.log("commands called", props=lambda: {
         "interaction": Logger.contextToObject(ctx),
         "success": True
     })
@@ -1,8 +1,13 @@
-import json
-from random import shuffle
+import base64
+import sys
+from array import array
+from collections import Counter
+import random
+from utils import codec
 from utils.Exceptions import BadRequest, NoMoreCardsException
 
 cardObject = {
+    "id": int,
     "link": str,
     "name": str,
     "props": dict
@@ -10,49 +15,149 @@ cardObject = {
 
 deckObject = {
     "name": str,
-    "cards": list[cardObject]
+    "cards": str
 }
 
 
 class Card:
-    def __init__(self, link: str, name: str, props: dict):
+    __slots__ = ("id", "link", "name", "props")
+
+    def __init__(self, link: str, name: str, props: dict, cardId: int | None = None):
+        self.id = cardId
         self.link = link
         self.name = name
         self.props = props
 
+    def toObject(self) -> cardObject:
+        return {"id": self.id, "link": self.link, "name": self.name, "props": self.props}
+
     def toJSONString(self) -> str:
-        return json.dumps(self.__dict__)
+        return codec.dumps(self.toObject())
 
 
 class Deck:
-    def __init__(self, name):
-        self.cards: list[str] = []
+    __slots__ = ("cardIds", "head", "name", "encoded", "storedEncoding", "changes")
+
+    def __init__(self, name, cards: array | list[int] | None = None, encoded: str | None = None):
+        # card ids live in a compact array; drawing moves the head forward instead of copying the rest
+        self.cardIds = array("H", cards) if cards else array("H")
+        self.head = 0
         self.name = name
+        # the encoded cards are kept until the deck changes, so unchanged decks aren't encoded on every save
+        self.encoded: str | None = encoded
+        # the encoding the deck was loaded with, and how many copies of each card were added (or taken away, if
+        # negative) since, so the ownership index can update its counts without counting the whole deck
+        self.storedEncoding = encoded
+        self.changes: Counter | None = None
+
+    def countChanges(self, cardIds, sign: int = 1) -> None:
+        if self.changes is None:
+            self.changes = Counter()
+        for cardId in cardIds:
+            self.changes[cardId] += sign
+
+    def __len__(self) -> int:
+        return len(self.cardIds) - self.head
 
-    def shuffle(self) -> None:
-        shuffle(self.cards)
+    @property
+    def cards(self) -> array:
+        return self.cardIds[self.head:]
 
-    def draw(self, num) -> list[str]:
+    def compact(self) -> None:
+        del self.cardIds[:self.head]
+        self.head = 0
+
+    def shuffle(self, rng: random.Random | None = None) -> None:
+        cards = list(self.cards)
+        (rng or random).shuffle(cards)
+        self.cardIds = array("H", cards)
+        self.head = 0
+        self.encoded = None
+
+    def draw(self, num, rng: random.Random | None = None) -> array:
         try:
             num = int(num)
         except Exception:
             raise BadRequest
-        if len(self.cards) > num:
-            return self.cards[0:num]
-        raise NoMoreCardsException("Attempted to draw cards from a deck with no cards")
+        if num < 1:
+            raise BadRequest("At least one card has to be drawn!")
+        if len(self) < num:
+            raise NoMoreCardsException("Attempted to draw cards from a deck with no cards")
+        if rng is not None:
+            # shuffle-on-draw: only the drawn positions get a random card from the rest of the deck,
+            # so drawing n cards costs n swaps however big the deck is
+            cardIds = self.cardIds
+            for i in range(self.head, self.head + num):
+                j = rng.randrange(i, len(cardIds))
+                cardIds[i], cardIds[j] = cardIds[j], cardIds[i]
+        drawn = self.cardIds[self.head:self.head + num]
+        self.head += num
+        self.encoded = None
+        self.countChanges(drawn, -1)
+        # only give the drawn space back once it is more than half of the array
+        if self.head * 2 > len(self.cardIds):
+            self.compact()
+        return drawn
+
+    def addCard(self, card: int | Card) -> None:
+        if type(card) == Card:
+            card = card.id
+        self.cardIds.append(card)
+        self.encoded = None
+        self.countChanges((card,))
+
+    def addCards(self, cards: list[int | Card]) -> None:
+        cardIds = [card.id if type(card) == Card else card for card in cards]
+        self.cardIds.extend(cardIds)
+        self.encoded = None
+        self.countChanges(cardIds)
 
-    def removeCard(self, card: str | Card) -> None:
+    def removeCard(self, card: int | Card) -> None:
         if type(card) == Card:
-            card = card.name
-        self.cards.remove(card)
+            card = card.id
+        self.compact()
+        self.cardIds.remove(card)
+        self.encoded = None
+        self.countChanges((card,), -1)
+
+    def toObject(self) -> deckObject:
+        if self.encoded is None:
+            self.encoded = encodeCardIds(self.cards)
+        return {"name": self.name, "cards": self.encoded}
 
     def toJSONString(self) -> str:
-        return json.dumps(self.__dict__)
+        return codec.dumps(self.toObject())
+
+
+def encodeCardIds(cardIds: array) -> str:
+    # little-endian uint16s, base64'd so they fit in json
+    data = array("H", cardIds)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return base64.b64encode(data.tobytes()).decode("ascii")
+
+
+def decodeCardIds(s: str) -> array:
+    data = array("H")
+    data.frombytes(base64.b64decode(s))
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data
 
 
-def cardFromObject(obj: cardObject):
-    return Card(link=obj["link"], name=obj["name"], props=obj["props"])
+def cardFromObject(obj: cardObject, cardId: int | None = None):
+    # obj is a dict or a typed record from codec.decode; cardId overrides the id it holds
+    return Card(link=obj["link"], name=obj["name"], props=obj["props"],
+                cardId=obj.get("id") if cardId is None else cardId)
 
 
 def cardFromJSONString(s: str):
-    return cardFromObject(json.loads(s))
+    return cardFromObject(codec.decode(s, "card"))
+
+
+def deckFromObject(obj: deckObject):
+    return Deck(name=obj["name"], cards=decodeCardIds(obj["cards"]))
+
+
+def deckFromJSONString(s: str):
+    return deckFromObject(codec.decode(s, "deck"))
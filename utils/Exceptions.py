@@ -10,3 +10,10 @@ class NoMoreCardsException(Exception):
     Error raised when there are no more cards in a player's deck's cards.
     """
     pass
+
+
+class CardIdsExhausted(Exception):
+    """
+    Error raised when every card id that fits in a deck array is taken.
+    """
+    pass
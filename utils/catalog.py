@@ -0,0 +1,152 @@
+import threading
+import time
+
+from utils.Deck import Card, cardFromObject, cardObject
+from utils.Exceptions import CardIdsExhausted
+
+# the largest id a uint16 deck array can hold
+maxCardId = 65535
+
+
+class CardCatalog:
+    def __init__(self, storage, checkInterval: float = 1.0):
+        self.storage = storage
+        self.checkInterval = checkInterval
+        self.lock = threading.Lock()
+        self.cards: dict[str, Card] = {}
+        self.lowerCards: dict[str, Card] = {}
+        # every name that was ever given an id, including cards that were since removed (retired),
+        # so that decks holding them can still be read
+        self.ids: dict[str, int] = {}
+        self.names: dict[int, str] = {}
+        # bumped every time the cards change, so that anything built from the catalog can tell it's stale
+        self.version = 0
+        self.storageVersion = None
+        self.lastCheck = 0.0
+        self.reload()
+
+    def reload(self):
+        with self.lock:
+            # new ids and newly retired cards have to be written back, or they'd be lost on restart
+            if self.load(self.storage.getCards()):
+                self.storage.saveCards(self.storedObjects())
+            self.storageVersion = self.storage.cardsVersion()
+            self.lastCheck = time.monotonic()
+
+    def nextId(self) -> int:
+        # decks and hands keep ids in uint16 arrays; ids of retired cards are never handed out again, as decks
+        # may still hold them, so once the top is reached only ids that were never used are left
+        cardId = max(self.names, default=-1) + 1
+        if cardId <= maxCardId:
+            return cardId
+        for cardId in range(maxCardId + 1):
+            if cardId not in self.names:
+                return cardId
+        raise CardIdsExhausted(f"All {maxCardId + 1} card ids are taken, including those of retired cards")
+
+    def load(self, cards: list[cardObject]) -> bool:
+        # returns whether the stored cards are missing ids or retired entries
+        needsSave = False
+        for obj in cards:
+            if obj.get("id") is not None:
+                self.ids[obj["name"]] = obj["id"]
+                self.names[obj["id"]] = obj["name"]
+        nextId = max(self.names, default=-1) + 1
+        newCards = {}
+        storedRetired = set()
+        for obj in cards:
+            name = obj["name"]
+            if name not in self.ids:
+                cardId = nextId if nextId <= maxCardId else self.nextId()
+                self.ids[name] = cardId
+                self.names[cardId] = name
+                nextId += 1
+            cardId = self.ids[name]
+            needsSave = needsSave or obj.get("id") != cardId
+            if obj.get("retired"):
+                storedRetired.add(name)
+                continue
+            # keep the old Card instance around if nothing about it changed
+            card = self.cards.get(name)
+            if card is None or card.id != cardId or card.link != obj["link"] or card.props != obj["props"]:
+                card = cardFromObject(obj, cardId)
+            newCards[name] = card
+        needsSave = needsSave or storedRetired != self.ids.keys() - newCards.keys()
+        if list(newCards.items()) != list(self.cards.items()):
+            self.cards = newCards
+            self.lowerCards = {name.lower(): card for name, card in newCards.items()}
+            self.version += 1
+        return needsSave
+
+    def refresh(self):
+        # the storage is asked whether the cards changed at most once every checkInterval seconds
+        now = time.monotonic()
+        if now - self.lastCheck < self.checkInterval:
+            return
+        self.lastCheck = now
+        if self.storage.cardsVersion() != self.storageVersion:
+            self.reload()
+
+    def replace(self, cards: list[cardObject]):
+        with self.lock:
+            self.load(cards)
+            self.storage.saveCards(self.storedObjects())
+            self.storageVersion = self.storage.cardsVersion()
+            self.lastCheck = time.monotonic()
+
+    def intern(self, name: str) -> int:
+        # names that aren't in the catalog (old player data, removed cards) still need an id
+        cardId = self.ids.get(name)
+        if cardId is not None:
+            return cardId
+        with self.lock:
+            # another thread may have given the name an id while this one waited for the lock
+            cardId = self.ids.get(name)
+            if cardId is not None:
+                return cardId
+            cardId = self.nextId()
+            self.ids[name] = cardId
+            self.names[cardId] = name
+            self.storage.saveCards(self.storedObjects())
+            self.storageVersion = self.storage.cardsVersion()
+        return cardId
+
+    def storedObjects(self) -> list[cardObject]:
+        retired = [{"id": cardId, "name": name, "link": "", "props": {}, "retired": True}
+                   for name, cardId in self.ids.items() if name not in self.cards]
+        return [self.cardToObject(card) for card in self.cards.values()] + retired
+
+    @staticmethod
+    def cardToObject(card: Card) -> cardObject:
+        return card.toObject()
+
+    def idOf(self, name: str) -> int | None:
+        return self.ids.get(name)
+
+    def nameOf(self, cardId: int) -> str:
+        return self.names.get(cardId, f"Unknown card #{cardId}")
+
+    def namesOf(self, cardIds) -> list[str]:
+        return [self.nameOf(cardId) for cardId in cardIds]
+
+    def get(self, name: str) -> Card | None:
+        self.refresh()
+        return self.cards.get(name)
+
+    def getCaseInsensitive(self, name: str) -> Card | None:
+        self.refresh()
+        return self.lowerCards.get(name.lower())
+
+    def all(self) -> list[Card]:
+        self.refresh()
+        return list(self.cards.values())
+
+    def toObjects(self) -> list[cardObject]:
+        return [self.cardToObject(card) for card in self.all()]
+
+    def __contains__(self, name: str) -> bool:
+        self.refresh()
+        return name in self.cards
+
+    def __len__(self) -> int:
+        return len(self.cards)
@@ -0,0 +1,108 @@
+import json
+
+# the fastest installed encoder is used; everything falls back to the standard library
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def dumps(obj, pretty: bool = False, default=None) -> str:
+    # compact unless asked otherwise; pretty output is only for files people read or edit, and always comes
+    # from the standard library, so those files look the same whichever encoder is installed
+    if default is None and msgspec is not None:
+        # records decoded by decode() are written back like the dicts they came from
+        default = msgspec.to_builtins
+    if pretty:
+        return json.dumps(obj, indent=4, default=default)
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS).decode()
+    if msgspec is not None:
+        return msgspec.json.encode(obj, enc_hook=default).decode()
+    return json.dumps(obj, separators=(",", ":"), default=default)
+
+
+class DecodeError(ValueError):
+    # what loads and decode raise on malformed input, whichever decoder is in use
+    pass
+
+
+# orjson's decode error is a subclass of the standard library's
+decoderErrors = (json.JSONDecodeError, msgspec.DecodeError) if msgspec is not None else (json.JSONDecodeError,)
+
+
+def loads(data: str | bytes):
+    try:
+        if orjson is not None:
+            return orjson.loads(data)
+        if msgspec is not None:
+            return msgspec.json.decode(data)
+        return json.loads(data)
+    except decoderErrors as error:
+        raise DecodeError(str(error)) from error
+
+
+def load(file):
+    return loads(file.read())
+
+
+if msgspec is not None:
+    class Record(msgspec.Struct):
+        # the code building cards, decks and players reads records like dicts
+        def __getitem__(self, key):
+            return getattr(self, key)
+
+        def get(self, key, default=None):
+            return getattr(self, key, default)
+
+    class CardRecord(Record):
+        name: str
+        link: str = ""
+        props: dict = {}
+        id: int | None = None
+        retired: bool = False
+
+    class DeckRecord(Record):
+        name: str
+        # encoded card ids, or card names in files written before card ids existed
+        cards: str | list[str] = ""
+
+    class PlayerRecord(Record):
+        username: str
+        id: int
+        hand: str | list[str] = ""
+        decks: list[DeckRecord] = []
+        activeDeck: str | None = None
+        draws: int = 0
+
+    class PlayersFile(Record):
+        players: list[PlayerRecord] = []
+
+    class CardsFile(Record):
+        cards: list[CardRecord] = []
+
+    decoders = {
+        "card": msgspec.json.Decoder(CardRecord),
+        "deck": msgspec.json.Decoder(DeckRecord),
+        "player": msgspec.json.Decoder(PlayerRecord),
+        "players": msgspec.json.Decoder(PlayersFile),
+        "cards": msgspec.json.Decoder(CardsFile)
+    }
+else:
+    decoders = {}
+
+
+def decode(data: str | bytes, schema: str):
+    # with msgspec, data is parsed and validated straight into typed records that Player, Deck and Card are built
+    # from, without nested dicts in between; otherwise it is loaded as usual
+    decoder = decoders.get(schema)
+    if decoder is None:
+        return loads(data)
+    try:
+        return decoder.decode(data)
+    except msgspec.DecodeError as error:
+        raise DecodeError(str(error)) from error
@@ -0,0 +1,54 @@
+import asyncio
+from typing import Awaitable, Callable
+
+
+class GroupCommit:
+    # player records saved within `window` seconds of each other are written by one durable commit, and
+    # every caller is resumed only once its record is on disk; while a commit runs, the next batch builds up
+    def __init__(self, commit: Callable[[list[dict]], Awaitable[None]], window: float = 0.005,
+                 batchSize: int = 256):
+        self.commit = commit
+        self.window = window
+        self.batchSize = batchSize
+        # player id -> newest record, and the callers waiting for it
+        self.pending: dict[int, dict] = {}
+        self.waiters: dict[int, list[asyncio.Future]] = {}
+        self.task: asyncio.Task | None = None
+        self.full: asyncio.Event | None = None
+
+    async def submit(self, record: dict):
+        future = asyncio.get_running_loop().create_future()
+        self.pending[record["id"]] = record
+        self.waiters.setdefault(record["id"], []).append(future)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        elif len(self.pending) >= self.batchSize and self.full is not None:
+            self.full.set()
+        await future
+
+    def takeBatch(self) -> tuple[list[dict], list[asyncio.Future]]:
+        ids = list(self.pending)[:self.batchSize]
+        records = [self.pending.pop(playerId) for playerId in ids]
+        waiters = [future for playerId in ids for future in self.waiters.pop(playerId)]
+        return records, waiters
+
+    async def run(self):
+        # only the first batch of a burst waits for the window; later ones already waited for the commit before them
+        self.full = asyncio.Event()
+        if self.window > 0 and len(self.pending) < self.batchSize:
+            try:
+                await asyncio.wait_for(self.full.wait(), self.window)
+            except asyncio.TimeoutError:
+                pass
+        while self.pending:
+            records, waiters = self.takeBatch()
+            try:
+                await self.commit(records)
+            except Exception as error:
+                for future in waiters:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            for future in waiters:
+                if not future.done():
+                    future.set_result(None)
@@ -1,17 +1,32 @@
+import asyncio
+import contextvars
+import functools
 import os
+import random
 import shutil
+import weakref
+from array import array
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
-import json
-from utils.Deck import Deck, Card, cardFromObject, cardObject, deckObject
+from utils import codec
+from utils.Deck import Deck, Card, cardObject, deckObject, encodeCardIds, decodeCardIds
 from utils.Exceptions import BadRequest
+from utils.catalog import CardCatalog
+from utils.commit import GroupCommit
+from utils.ownership import OwnershipIndex
+from utils.shuffle import ShuffleEngine, deriveSeed
+from utils.storage import JsonStorage, ShardedStorage, SqliteStorage
 
 import discord
 
 playerObject = {
     "username": str,
     "id": int,
-    "hand": list[str],
-    "deck": list[deckObject]
+    "hand": str,
+    "deck": list[deckObject],
+    "draws": int
 }
 
 
@@ -23,83 +38,226 @@ class PlayerNotFound(Exception):
 
 
 class helperUser:
+    __slots__ = ("name", "id")
+
     def __init__(self, name, userID):
         self.name = name
         self.id = userID
 
 
-def userFromDictionary(arg: dict, decks: list[Deck]):
+def userFromDictionary(arg: dict, decks: list[Deck], hand: array | None = None):
     return Player(
         user=helperUser(arg["username"], arg["id"]),
-        hand=arg["hand"],
+        hand=hand if hand is not None else arg["hand"],
         decks=decks,
-        activeDeck=arg["activeDeck"]
+        activeDeck=arg["activeDeck"],
+        draws=arg.get("draws") or 0
     )
 
 
 class Player:
-    def __init__(self, user: discord.Member | helperUser, hand: list[str], decks: list[Deck], activeDeck: str | None):
+    __slots__ = ("username", "id", "hand", "decks", "activeDeck", "draws")
+
+    def __init__(self, user: discord.Member | helperUser, hand: array | list[int], decks: list[Deck],
+                 activeDeck: str | None, draws: int = 0):
         self.username = user.name
         self.id = user.id
-        self.hand = hand if hand else []
-        self.decks = decks if decks else []
-        self.activeDeck = activeDeck if activeDeck else None
-
-    @property
-    def __dict__(self):
+        self.hand = array("H", hand) if hand else array("H")
+        # decks are keyed by name, and the active one is kept as a direct reference
+        self.decks: dict[str, Deck] = {deck.name: deck for deck in decks} if decks else {}
+        self.activeDeck: Deck | None = self.decks.get(activeDeck) if activeDeck else None
+        # how many shuffled draws the player has made; it picks the random stream of the next one
+        self.draws = draws
+
+    def toObject(self) -> playerObject:
+        # decks reuse their encoded cards until they change, so this stays cheap for players with many decks
         return {
             "username": self.username,
             "id": self.id,
-            "hand": self.hand,
-            "decks": [deck.__dict__ for deck in self.decks],
-            "activeDeck": self.activeDeck
+            "hand": encodeCardIds(self.hand),
+            "decks": [deck.toObject() for deck in self.decks.values()],
+            "activeDeck": self.activeDeck.name if self.activeDeck else None,
+            "draws": self.draws
         }
 
     def toJSONString(self):
-        return json.dumps(self.__dict__)
+        return codec.dumps(self.toObject())
 
     def __repr__(self):
-        return f"""Player;username={self.username},id={self.id},hand={self.hand},decks={self.decks}"""
+        return f"""Player;username={self.username},id={self.id},hand={self.hand},decks={list(self.decks.values())}"""
+
+    def getDeck(self, name: str) -> Deck | None:
+        return self.decks.get(name)
+
+    def addDeck(self, deck: Deck):
+        self.decks[deck.name] = deck
+
+    def removeDeck(self, name: str) -> bool:
+        deck = self.decks.pop(name, None)
+        if deck is not None and deck is self.activeDeck:
+            self.activeDeck = None
+        return deck is not None
+
+    def setActiveDeck(self, name: str) -> bool:
+        deck = self.decks.get(name)
+        if deck is not None:
+            self.activeDeck = deck
+        return deck is not None
 
-    def draw(self, n: int):
+    def draw(self, n: int, rng: random.Random | None = None):
         if self.activeDeck is None:
             raise BadRequest("Active deck not chosen!")
+        if n < 1:
+            raise BadRequest("At least one card has to be drawn!")
         if n > len(self.activeDeck):
             raise BadRequest("Active deck has too little cards!")
-        activeDeckIndex = -1
-        for i, deck in enumerate(self.decks):
-            if deck.name == self.activeDeck:
-                activeDeckIndex = i
-        if n > len(self.decks[activeDeckIndex].cards):
-            raise BadRequest("Active deck has too little cards!")
-        self.hand.extend(self.decks[activeDeckIndex].cards[0:n])
-        self.decks[activeDeckIndex].cards = self.decks[activeDeckIndex].cards[n::]
+        self.hand.extend(self.activeDeck.draw(n, rng))
         return self
 
-    def play(self, cardName: str):
+    def play(self, cardId: int):
         if self.activeDeck is None:
             raise BadRequest("Active deck not chosen!")
-        activeDeckIndex = -1
-        for i, deck in enumerate(self.decks):
-            if deck.name == self.activeDeck:
-                activeDeckIndex = i
-        if cardName not in self.hand:
+        if cardId not in self.hand:
             raise BadRequest("Card inputted is not in your hand!")
-        self.decks[activeDeckIndex].cards.append(cardName)
-        self.hand.remove(cardName)
+        self.activeDeck.addCard(cardId)
+        self.hand.remove(cardId)
+        return self
+
+    def playMany(self, cardIds: list[int]):
+        # every card is checked before any is moved, so a bad batch leaves the hand untouched
+        if self.activeDeck is None:
+            raise BadRequest("Active deck not chosen!")
+        inHand = Counter(self.hand)
+        if any(inHand[cardId] < count for cardId, count in Counter(cardIds).items()):
+            raise BadRequest("Not all of those cards are in your hand!")
+        self.activeDeck.addCards(cardIds)
+        for cardId in cardIds:
+            self.hand.remove(cardId)
         return self
 
 
+class UnitOfWork:
+    # one per command: each player is loaded at most once and shared by every helper the command calls,
+    # then the changed players are saved once, when the command's transaction ends
+    def __init__(self, lockTimeout: float = 5.0):
+        self.db: "Database | None" = None
+        self.players: dict[int, Player] = {}
+        self.dirty: set[int] = set()
+        self.locks: dict[int, asyncio.Lock] = {}
+        self.lockTimeout = lockTimeout
+        # how many transactions are open, as the players are saved when the outermost one ends
+        self.depth = 0
+
+    async def lock(self, db: "Database", playerId: int):
+        if playerId in self.locks:
+            return
+        lock = db.playerLock(playerId)
+        if not self.locks:
+            await lock.acquire()
+        else:
+            # waiting on a second player while holding the first could deadlock against a command doing the
+            # opposite, so that wait is bounded
+            try:
+                await asyncio.wait_for(lock.acquire(), self.lockTimeout)
+            except asyncio.TimeoutError:
+                raise BadRequest("That player is busy, please try again.")
+        self.locks[playerId] = lock
+
+    def bind(self, db: "Database"):
+        if self.db is None:
+            self.db = db
+        elif self.db is not db:
+            raise RuntimeError("A unit of work can only span one database")
+
+    async def getPlayer(self, db: "Database", playerId: str | int) -> Player:
+        self.bind(db)
+        playerId = int(playerId)
+        player = self.players.get(playerId)
+        if player is None:
+            await self.lock(db, playerId)
+            player = self.players[playerId] = await db.findPlayerAsync(playerId)
+        return player
+
+    async def createPlayer(self, db: "Database", user: discord.Member) -> Player:
+        self.bind(db)
+        await self.lock(db, int(user.id))
+        player = self.players[int(user.id)] = await db.createNewPlayerAsync(user)
+        return player
+
+    def markDirty(self, player: Player):
+        self.dirty.add(int(player.id))
+
+    async def commit(self):
+        for playerId in self.dirty:
+            await self.db.savePlayerAsync(self.players[playerId])
+        self.dirty.clear()
+
+    def release(self):
+        for lock in self.locks.values():
+            lock.release()
+        self.locks.clear()
+
+
+currentUnitOfWork: contextvars.ContextVar[UnitOfWork | None] = contextvars.ContextVar("unitOfWork", default=None)
+
+
+def unitOfWork(function):
+    # wraps a command handler; handlers called from other handlers join the outer command's unit of work,
+    # and nothing is saved if the command raises
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        if currentUnitOfWork.get() is not None:
+            return await function(*args, **kwargs)
+        work = UnitOfWork()
+        token = currentUnitOfWork.set(work)
+        try:
+            result = await function(*args, **kwargs)
+            await work.commit()
+            return result
+        finally:
+            work.release()
+            currentUnitOfWork.reset(token)
+
+    return wrapper
+
+
+# blocking storage work from the async API runs here, so it never stalls the event loop
+storageExecutor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="storage")
+
+
 class Database:
-    def __init__(self, path: str):
+    def __init__(self, path: str, backend: str = "json", flushInterval: float = 5.0,
+                 executor: ThreadPoolExecutor = storageExecutor, commitWindow: float | None = 0.005,
+                 commitBatchSize: int = 256, shuffleMode: str = "lazy", shuffleSeed: int | None = None,
+                 dataFolder: Path | None = None, catalog: CardCatalog | None = None):
         self.path = path
+        self.backend = backend
+        self.flushInterval = flushInterval
+        self.executor = executor
+        # async saves are grouped into durable commits; with no commitWindow they are only queued for the
+        # next background flush, as the synchronous savePlayer does
+        self.groupCommit = GroupCommit(self.commitRecords, commitWindow, commitBatchSize) \
+            if commitWindow is not None else None
         self.root = os.path.dirname(os.path.abspath(path))
-        self.playersFolderPath = Path(f"{self.root}/data")
+        # players live under data/, or in a folder of their own for guild partitions
+        self.playersFolderPath = dataFolder or Path(f"{self.root}/data")
         self.cardsFolderPath = Path(f"{self.root}/assets/cards")
         self.playersFilePath = self.playersFolderPath / "players.json"
+        self.databaseFilePath = self.playersFolderPath / "players.db"
+        self.shardsFolderPath = self.playersFolderPath / "players"
         self.cardsFilePath = self.cardsFolderPath / "cards.json"
-        self.cards = self.getCards()
 
+        self.storage = self.openStorage()
+        # the card catalog can be shared with other databases, in which case it is left to its owner
+        self.ownsCatalog = catalog is None
+        self.catalog = catalog if catalog is not None else CardCatalog(self.storage)
+        self.ownership = OwnershipIndex(self.iterPlayers)
+        self.ownership.buildInBackground()
+        self.shuffler = ShuffleEngine(self.playersFolderPath / "shuffle.json", shuffleMode, shuffleSeed)
+        # one lock per player, dropped automatically once no transaction holds it
+        self.playerLocks: weakref.WeakValueDictionary[int, asyncio.Lock] = weakref.WeakValueDictionary()
+
+    def openStorage(self):
         # initialize an empty database, in case it doesn't exist
         def initializeDB():
             with open(self.playersFilePath, "w") as playersFile:
@@ -118,81 +276,254 @@ class Database:
             folderPath=self.cardsFolderPath, filePath=self.cardsFilePath, initFunction=initializeCards
         )
 
+        if self.backend == "json":
+            return JsonStorage(self.playersFilePath, self.cardsFilePath, self.flushInterval)
+        if self.backend == "sharded":
+            return ShardedStorage(self.shardsFolderPath, self.playersFilePath, self.cardsFilePath, self.flushInterval)
+        if self.backend == "sqlite":
+            return SqliteStorage(self.databaseFilePath, self.playersFilePath, self.cardsFilePath)
+        raise BadRequest(f"Unknown storage backend {self.backend}! Please use json, sharded or sqlite")
+
     @staticmethod
     def createFileIfNotExists(folderPath, filePath, initFunction):
         if not filePath.exists():
             try:
                 initFunction()
             except FileNotFoundError:  # Directory does not exist
-                os.mkdir(folderPath)
+                os.makedirs(folderPath, exist_ok=True)
                 initFunction()
 
+    @staticmethod
+    def playerToRecord(player: Player) -> playerObject:
+        # hand and deck cards are stored encoded, which also copies them away from the Player
+        return player.toObject()
+
+    def decodeCards(self, cards: str | list[str]) -> array:
+        # records written before card ids existed hold plain card names
+        if isinstance(cards, str):
+            return decodeCardIds(cards)
+        return array("H", [self.catalog.intern(name) for name in cards])
+
+    def describePlayer(self, player: Player) -> dict:
+        # card ids are only turned back into names here, for showing the player to people
+        return {
+            "username": player.username,
+            "id": player.id,
+            "hand": self.catalog.namesOf(player.hand),
+            "decks": [{"name": deck.name, "cards": self.catalog.namesOf(deck.cards)} for deck in player.decks.values()],
+            "activeDeck": player.activeDeck.name if player.activeDeck else None
+        }
+
+    def playerFromRecord(self, record: playerObject) -> Player:
+        # decks keep the encoding they were stored with until they change, so unchanged decks are neither encoded
+        # again on save nor counted again by the ownership index
+        decks = [Deck(name=deck["name"], cards=self.decodeCards(deck["cards"]),
+                      encoded=deck["cards"] if isinstance(deck["cards"], str) else None) for deck in record["decks"]]
+        return userFromDictionary(record, decks, hand=self.decodeCards(record["hand"]))
+
+    def playerFromJSONString(self, s: str) -> Player:
+        return self.playerFromRecord(codec.decode(s, "player"))
+
     def getPlayers(self) -> list[playerObject]:
-        with open(self.playersFilePath, "r") as file:
-            return json.load(file)["players"]
+        return self.storage.getPlayers()
+
+    def iterPlayers(self):
+        return (self.playerFromRecord(record) for record in self.storage.iterPlayers())
+
+    @property
+    def cards(self) -> list[cardObject]:
+        return self.catalog.toObjects()
 
     def getCards(self) -> list[cardObject]:
-        with open(self.cardsFilePath, "r") as file:
-            return json.load(file)["cards"]
+        return self.catalog.toObjects()
 
     def getCardFromName(self, name: str) -> Card:
-        for card in self.getCards():
-            if card["name"] == name:
-                return cardFromObject(card)
+        return self.catalog.get(name)
 
     def isValidCardName(self, name: str) -> bool:
-        return name in [c["name"] for c in self.cards]
+        return name in self.catalog
+
+    def cardIdsFromNames(self, names: list[str]) -> tuple[list[int], list[str]]:
+        # returns the ids of the known names and the names that aren't cards
+        ids, unknown = [], []
+        for name in names:
+            if name in self.catalog:
+                ids.append(self.catalog.idOf(name))
+            else:
+                unknown.append(name)
+        return ids, unknown
 
     def findPlayer(self, playerId: str | int) -> Player:
-        for player in self.getPlayers():
-            if player["id"] == playerId:
-                decks = []
-                for deck in player["decks"]:
-                    decks.append(
-                        Deck(name=deck["name"])
-                    )
-                    decks[-1].cards = deck["cards"]
-                return userFromDictionary(player, decks)
+        record = self.storage.getPlayer(playerId)
+        if record is not None:
+            return self.playerFromRecord(record)
         raise PlayerNotFound(f"The player could not be found! Id sent: {playerId}")
 
     def findPlayerFromName(self, playerName: str) -> Player:
-        for player in self.getPlayers():
-            if player["userName"] == playerName:
-                decks = []
-                for deck in player["decks"]:
-                    decks.append(
-                        Deck(name=deck["name"])
-                    )
-                    decks[-1].cards = deck["cards"]
-                return userFromDictionary(player, decks)
+        record = self.storage.getPlayerFromName(playerName)
+        if record is not None:
+            return self.playerFromRecord(record)
         raise PlayerNotFound(f"The player could not be found! Name sent: {playerName}")
 
     def createNewPlayer(self, newPlayer: discord.Member) -> Player:
         newPlayer = Player(newPlayer, hand=[], decks=[], activeDeck=None)
-        with open(self.playersFilePath, "r") as file:
-            oldData = json.load(file)
-        with open(self.playersFilePath, "w") as file:
-            newPlayers = oldData["players"]
-            newPlayers.append(newPlayer.__dict__)
-            newData = {"players": newPlayers}
-            file.write(json.dumps(newData, indent=4))
+        self.storage.insertPlayer(self.playerToRecord(newPlayer))
         return newPlayer
 
     def savePlayer(self, player: Player):
-        players = self.getPlayers()
-        for i, p in enumerate(players):
-            if p["id"] == player.id:
-                players[i] = player.__dict__
-        with open(self.playersFilePath, "w") as file:
-            file.write(json.dumps({"players": players}, indent=4))
-
-    def saveCards(self):
-        with open(self.cardsFilePath, "w") as file:
-            file.write(json.dumps({"cards": self.cards}, indent=4))
-
-    @staticmethod
-    def deleteAllData():
-        shutil.rmtree("data")
+        self.storage.updatePlayer(self.playerToRecord(player))
+        self.ownership.update(player)
+
+    def exportPlayers(self, path: Path):
+        # a readable copy of every player, with card names, for people; the bot's own files are written compact
+        players = [self.describePlayer(player) for player in self.iterPlayers()]
+        with open(path, "w") as file:
+            file.write(codec.dumps({"players": players}, pretty=True))
+
+    def flush(self):
+        self.storage.flush()
+
+    def close(self):
+        self.storage.close()
+
+    def saveCards(self, cards: list[cardObject] | None = None):
+        self.catalog.replace(self.cards if cards is None else cards)
+
+    def deleteAllData(self):
+        self.storage.clear()
+        self.storage.close()
+        self.ownership.reset()
+        # only this database's own files go (players.json, its journals, players.db, the players/ shards and the
+        # shuffle seed), so guild partitions kept in folders under it are left alone
+        for path in [*self.playersFolderPath.glob("players*"), self.playersFolderPath / "shuffle.json"]:
+            if path.is_dir():
+                shutil.rmtree(path)
+            else:
+                path.unlink(missing_ok=True)
 
     def restart(self):
-        self.__init__(self.path)
+        # players are reloaded from a fresh storage, while the card catalog is only refreshed in place
+        self.close()
+        self.storage = self.openStorage()
+        if self.ownsCatalog:
+            self.catalog.storage = self.storage
+            self.catalog.reload()
+        self.ownership.reset()
+        self.ownership.buildInBackground()
+
+    def isIdle(self) -> bool:
+        # no command holds one of its players and no save is waiting to be committed
+        if any(lock.locked() for lock in list(self.playerLocks.values())):
+            return False
+        return self.groupCommit is None or not self.groupCommit.pending and (
+            self.groupCommit.task is None or self.groupCommit.task.done())
+
+    def playerLock(self, playerId: int) -> asyncio.Lock:
+        lock = self.playerLocks.get(playerId)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.playerLocks[playerId] = lock
+        return lock
+
+    async def loadPlayer(self, playerId: str | int) -> Player:
+        # the command's unit of work hands out the player it already loaded, if there is one
+        work = currentUnitOfWork.get()
+        if work is None:
+            return await self.findPlayerAsync(playerId)
+        return await work.getPlayer(self, playerId)
+
+    async def createPlayer(self, user: discord.Member) -> Player:
+        work = currentUnitOfWork.get()
+        if work is None:
+            return await self.createNewPlayerAsync(user)
+        return await work.createPlayer(self, user)
+
+    @asynccontextmanager
+    async def transaction(self, playerId: str | int):
+        # loads the player under its lock and saves it when the block exits without an exception,
+        # so that concurrent commands on the same player can't overwrite each other; inside a unit of
+        # work the player stays loaded and locked for the rest of the command, and the outermost
+        # transaction saves what changed before the command goes on to reply
+        work = currentUnitOfWork.get()
+        if work is not None:
+            player = await work.getPlayer(self, playerId)
+            work.depth += 1
+            try:
+                yield player
+            finally:
+                work.depth -= 1
+            work.markDirty(player)
+            if not work.depth:
+                await work.commit()
+            return
+        async with self.playerLock(playerId):
+            player = await self.findPlayerAsync(playerId)
+            yield player
+            await self.savePlayerAsync(player)
+
+    async def runInExecutor(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def findPlayerAsync(self, playerId: str | int) -> Player:
+        return await self.runInExecutor(self.findPlayer, playerId)
+
+    async def findPlayerFromNameAsync(self, playerName: str) -> Player:
+        return await self.runInExecutor(self.findPlayerFromName, playerName)
+
+    async def commitRecords(self, records: list[playerObject]):
+        await self.runInExecutor(self.storage.commit, records)
+
+    async def createNewPlayerAsync(self, newPlayer: discord.Member) -> Player:
+        if self.groupCommit is None:
+            return await self.runInExecutor(self.createNewPlayer, newPlayer)
+        player = Player(newPlayer, hand=[], decks=[], activeDeck=None)
+        await self.groupCommit.submit(self.playerToRecord(player))
+        return player
+
+    async def savePlayerAsync(self, player: Player):
+        if self.groupCommit is None:
+            await self.runInExecutor(self.savePlayer, player)
+        else:
+            await self.groupCommit.submit(self.playerToRecord(player))
+            self.ownership.update(player)
+
+    async def saveCardsAsync(self, cards: list[cardObject] | None = None):
+        await self.runInExecutor(self.saveCards, cards)
+
+    async def shuffleAllDecksAsync(self, seed: int | None = None, batchSize: int = 4096) -> tuple[int, int]:
+        # starts a new game and reshuffles every deck of every player; a batch of players is loaded, shuffled
+        # and committed under their locks, so commands running meanwhile wait for their batch instead of being
+        # overwritten, and only one batch is in memory at a time
+        seed = await self.runInExecutor(self.shuffler.newGame, seed)
+        playerIds = sorted(await self.runInExecutor(self.storage.playerIds))
+        playerCount = deckCount = 0
+        for start in range(0, len(playerIds), batchSize):
+            batchIds = playerIds[start:start + batchSize]
+            locks = [self.playerLock(playerId) for playerId in batchIds]
+            for lock in locks:
+                await lock.acquire()
+            try:
+                deckCount += await self.runInExecutor(self.shuffleBatch, batchIds, deriveSeed(seed, start))
+            finally:
+                for lock in locks:
+                    lock.release()
+            playerCount += len(batchIds)
+        return playerCount, deckCount
+
+    def shuffleBatch(self, playerIds: list[int], seed: int) -> int:
+        players = []
+        for playerId in playerIds:
+            try:
+                players.append(self.findPlayer(playerId))
+            except PlayerNotFound:
+                pass  # removed since the ids were listed
+        decks = [deck for player in players for deck in player.decks.values()]
+        self.shuffler.shuffleDecks(decks, seed)
+        self.storage.commit([self.playerToRecord(player) for player in players])
+        return len(decks)
+
+    async def deleteAllDataAsync(self):
+        await self.runInExecutor(self.deleteAllData)
+
+    async def restartAsync(self):
+        await self.runInExecutor(self.restart)
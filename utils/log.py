@@ -1,21 +1,39 @@
+import atexit
+import gzip
 import os
 import pathlib
+import queue
+import random
+import shutil
+import sys
+import threading
 import time
+import traceback
 from datetime import datetime
-import json
-from json import JSONDecodeError
 
 import discord
 from discord.ext.commands.context import Context
 
+from utils import codec
+
+# same numbers as the standard logging module
+levels = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+
 
 class Log:
-    def __init__(self, content, props):
+    __slots__ = ("unix", "prettyTime", "level", "content", "props")
+
+    def __init__(self, content, props, level: str = "info"):
         self.unix = time.time()
         self.prettyTime = datetime.utcfromtimestamp(self.unix).strftime('%Y-%m-%d %H:%M:%S')
+        self.level = level
         self.content = str(content)
         self.props = props
 
+    def toObject(self) -> dict:
+        return {"unix": self.unix, "prettyTime": self.prettyTime, "level": self.level, "content": self.content,
+                "props": self.props}
+
     def prettify(self):
         return f"""Log event @ {self.unix}, or {self.prettyTime}
 log content: {self.content}"""
@@ -25,10 +43,27 @@ log content: {self.content}"""
 
 
 class Logger:
-    def __init__(self, path):
+    def __init__(self, path, batchSize: int = 256, maxBytes: int = 16 * 1024 * 1024, maxAge: float = 24 * 60 * 60,
+                 keepArchives: int = 14, level: str = "info", sampleRate: float = 1.0,
+                 sampleRates: dict[str, float] | None = None):
         root = os.path.dirname(os.path.abspath(path))
         self.folderPath = pathlib.Path(f"{root}/logs")
-        self.filePath = self.folderPath / "logs.json"
+        self.filePath = self.folderPath / "logs.jsonl"
+        self.legacyFilePath = self.folderPath / "logs.json"
+        self.batchSize = batchSize
+        # the current segment is rolled over once it is bigger than maxBytes or older than maxAge
+        # seconds; only the newest keepArchives compressed segments are kept
+        self.maxBytes = maxBytes
+        self.maxAge = maxAge
+        self.keepArchives = keepArchives
+        self.archiveThreads: list[threading.Thread] = []
+        self.archiveLock = threading.Lock()
+        # records below level are dropped; records below warning are kept with a probability of
+        # sampleRates[message], or sampleRate for messages without their own rate
+        self.level = levels[level]
+        self.sampleRate = sampleRate
+        self.sampleRates = dict(sampleRates or {})
+        self.random = random.Random()
 
         if not self.filePath.exists():
             try:
@@ -36,24 +71,158 @@ class Logger:
             except FileNotFoundError:  # Directory does not exist
                 os.mkdir(self.folderPath)
                 self.rewriteLogs()
+        self.convertLegacyLogs()
+        self.segmentStart = self.readSegmentStart()
+        self.archiveInBackground()  # leftovers from a run that stopped mid-rotation
+
+        # log records are queued and written in batches by a background thread
+        self.writeLock = threading.Lock()
+        self.queue: queue.SimpleQueue[Log | None] = queue.SimpleQueue()
+        self.writerThread = threading.Thread(target=self.writeLoop, name="log-writer", daemon=True)
+        self.writerThread.start()
+        atexit.register(self.close)
+
+    def convertLegacyLogs(self):
+        # older versions kept every log in a single JSON document; move them over once
+        if not self.legacyFilePath.exists():
+            return
+        try:
+            with open(self.legacyFilePath, "r") as file:
+                oldLogs = codec.load(file)["logs"]
+        except (codec.DecodeError, KeyError):
+            oldLogs = []
+        with open(self.filePath, "a") as file:
+            for log in oldLogs:
+                file.write(codec.dumps(log, default=str) + "\n")
+        os.replace(self.legacyFilePath, self.legacyFilePath.with_suffix(".json.migrated"))
+
+    def readSegmentStart(self) -> float:
+        # a segment left by an earlier run keeps its age, taken from its first record, so that restarts
+        # don't keep postponing the rotation
+        try:
+            with open(self.filePath, "r") as file:
+                first = file.readline()
+            return float(codec.loads(first)["unix"])
+        except (OSError, codec.DecodeError, KeyError, TypeError, ValueError):
+            return time.time()
 
     def rewriteLogs(self):
-        with open(self.filePath, "w") as file:
-            file.write('{"logs":[]}')
+        with open(self.filePath, "w"):
+            pass
 
-    def log(self, message, props=None):
-        log = Log(message, props=props)
-        with open(self.filePath, "r") as file:
+    def isEmitted(self, message, level: str) -> bool:
+        number = levels[level]
+        if number < self.level:
+            return False
+        if number >= levels["warning"]:
+            return True
+        rate = self.sampleRates.get(message, self.sampleRate)
+        return rate >= 1.0 or self.random.random() < rate
+
+    def log(self, message, props=None, level: str = "info"):
+        # props can be a function returning them, so that dropped records never build their props
+        if not self.isEmitted(message, level):
+            return
+        if callable(props):
+            props = props()
+        self.queue.put(Log(message, props=props, level=level))
+
+    def writeLoop(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < self.batchSize:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+            # a batch that can't be written (a full disk, a failed rotation) is reported and dropped, so the
+            # writer keeps draining the queue instead of dying with it
             try:
-                oldData = json.load(file)
-            except JSONDecodeError:
-                self.rewriteLogs()
-                oldData = json.load(file)
-        with open(self.filePath, "w") as file:
-            newLogs = oldData["logs"]
-            newLogs.append(log.__dict__)
-            newData = {"logs": newLogs}
-            file.write(json.dumps(newData, indent=4))
+                self.writeBatch([log for log in batch if log is not None])
+            except Exception:
+                print(f"Could not write {len(batch)} log records:", file=sys.stderr)
+                traceback.print_exc()
+
+    @staticmethod
+    def encode(log: Log) -> str:
+        try:
+            return codec.dumps(log.toObject(), default=str)
+        except (TypeError, ValueError):
+            # props the encoder refuses, such as integers wider than 64 bits, are kept as text
+            return codec.dumps({**log.toObject(), "props": repr(log.props)})
+
+    def writeBatch(self, batch: list[Log]):
+        if not batch:
+            return
+        lines = "".join(self.encode(log) + "\n" for log in batch)
+        with self.writeLock:
+            if self.shouldRotate():
+                self.rotate()
+            with open(self.filePath, "a") as file:
+                file.write(lines)
+
+    def shouldRotate(self) -> bool:
+        if time.time() - self.segmentStart >= self.maxAge:
+            return self.filePath.stat().st_size > 0
+        return self.filePath.stat().st_size >= self.maxBytes
+
+    def rotate(self):
+        suffix = datetime.utcnow().strftime("%Y%m%d-%H%M%S-%f")
+        os.replace(self.filePath, self.folderPath / f"logs-{suffix}.jsonl")
+        self.rewriteLogs()
+        self.segmentStart = time.time()
+        self.archiveInBackground()
+
+    def archiveInBackground(self):
+        self.archiveThreads = [thread for thread in self.archiveThreads if thread.is_alive()]
+        thread = threading.Thread(target=self.archiveSegments, name="log-archiver", daemon=True)
+        thread.start()
+        self.archiveThreads.append(thread)
+
+    def archiveSegments(self):
+        with self.archiveLock:
+            self.compressSegments()
+            self.pruneArchives()
+
+    def compressSegments(self):
+        for segment in sorted(self.folderPath.glob("logs-*.jsonl")):
+            archivePath = segment.with_suffix(".jsonl.gz")
+            try:
+                with open(segment, "rb") as source, gzip.open(archivePath, "wb") as target:
+                    shutil.copyfileobj(source, target)
+                os.remove(segment)
+            except FileNotFoundError:
+                continue
+
+    def pruneArchives(self):
+        archives = sorted(self.folderPath.glob("logs-*.jsonl.gz"))
+        for archive in archives[:max(len(archives) - self.keepArchives, 0)]:
+            try:
+                os.remove(archive)
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        if not self.writerThread.is_alive():
+            return
+        self.queue.put(None)
+        self.writerThread.join()
+        for thread in self.archiveThreads:
+            thread.join()
+        atexit.unregister(self.close)
+
+    @staticmethod
+    def parseSampleRates(text: str) -> dict[str, float]:
+        # "whoAmI called=0.1;draw called=0.01" -> {"whoAmI called": 0.1, "draw called": 0.01}
+        rates = {}
+        for entry in text.split(";"):
+            message, _, rate = entry.rpartition("=")
+            if message.strip():
+                rates[message.strip()] = float(rate)
+        return rates
 
     @staticmethod
     def contextToObject(ctx: Context):
@@ -62,12 +231,24 @@ class Logger:
             "message": Logger.messageToObject(ctx.message)
         }
 
+    @staticmethod
+    def interactionToObject(interaction: discord.Interaction):
+        # slash commands come without a message, so the user and channel are taken from the interaction
+        return {
+            "type": "interaction",
+            "command": interaction.command.name if interaction.command else None,
+            "author": Logger.memberToObject(interaction.user),
+            "channelID": interaction.channel.id if interaction.channel else None,
+            "channelName": getattr(interaction.channel, "name", None)
+        }
+
     @staticmethod
     def memberToObject(member: discord.Member):
+        # users outside guilds have no roles, and users without an avatar have none to link
         return {
-            "avatar": member.avatar.url if not member.bot else None,
+            "avatar": member.avatar.url if member.avatar and not member.bot else None,
             "name": member.name,
-            "roles": [str(x) for x in member.roles]
+            "roles": [str(x) for x in getattr(member, "roles", [])]
         }
 
     @staticmethod
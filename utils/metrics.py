@@ -0,0 +1,196 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+from pathlib import Path
+
+import discord
+from discord.ext import commands
+
+# histogram bucket upper bounds, in seconds
+bucketBounds = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+phases = ("total", "storageRead", "storageWrite", "logging", "discordSend")
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(bucketBounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(bucketBounds, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        # upper bound of the bucket the quantile falls in, which is as precise as buckets get
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(bucketBounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms: dict[tuple[str, str], Histogram] = {}
+        # phase -> seconds spent so far by the command running in this task
+        self.timings: contextvars.ContextVar[dict[str, float] | None] = contextvars.ContextVar("timings", default=None)
+        # set while a timed call runs, so the calls it makes itself (a hybrid command's Context.send calling
+        # send_message) aren't counted twice
+        self.timing: contextvars.ContextVar[bool] = contextvars.ContextVar("timing", default=False)
+        self.exporter: threading.Thread | None = None
+
+    def observe(self, command: str, phase: str, seconds: float):
+        with self.lock:
+            histogram = self.histograms.get((command, phase))
+            if histogram is None:
+                histogram = self.histograms[(command, phase)] = Histogram()
+            histogram.observe(seconds)
+
+    def addTime(self, phase: str, seconds: float):
+        timings = self.timings.get()
+        if timings is not None:
+            timings[phase] = timings.get(phase, 0.0) + seconds
+
+    def instrumented(self, function):
+        # wraps a command handler; handlers called from other handlers count towards the outer command
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            if self.timings.get() is not None:
+                return await function(*args, **kwargs)
+            timings = {}
+            token = self.timings.set(timings)
+            start = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                self.timings.reset(token)
+                self.observe(function.__name__, "total", time.perf_counter() - start)
+                for phase, seconds in timings.items():
+                    self.observe(function.__name__, phase, seconds)
+
+        return wrapper
+
+    def timed(self, function, phase: str):
+        # only the outermost timed call adds its time
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def asyncWrapper(*args, **kwargs):
+                if self.timing.get():
+                    return await function(*args, **kwargs)
+                token = self.timing.set(True)
+                start = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    self.addTime(phase, time.perf_counter() - start)
+                    self.timing.reset(token)
+
+            return asyncWrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if self.timing.get():
+                return function(*args, **kwargs)
+            token = self.timing.set(True)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.addTime(phase, time.perf_counter() - start)
+                self.timing.reset(token)
+
+        return wrapper
+
+    def install(self, db, logger):
+        # times the storage, logging and discord calls the handlers make, without touching the handlers
+        if hasattr(db, "whenOpened"):
+            # guild partitions are timed as they are opened
+            db.whenOpened(self.instrumentDatabase)
+        else:
+            self.instrumentDatabase(db)
+        logger.log = self.timed(logger.log, "logging")
+        if not hasattr(commands.Context.send, "__wrapped__"):
+            commands.Context.send = self.timed(commands.Context.send, "discordSend")
+            discord.InteractionResponse.send_message = self.timed(
+                discord.InteractionResponse.send_message, "discordSend"
+            )
+
+    def instrumentDatabase(self, db):
+        for name in ("findPlayerAsync", "findPlayerFromNameAsync"):
+            setattr(db, name, self.timed(getattr(db, name), "storageRead"))
+        for name in ("savePlayerAsync", "createNewPlayerAsync", "saveCardsAsync", "deleteAllDataAsync", "restartAsync",
+                     "shuffleAllDecksAsync"):
+            setattr(db, name, self.timed(getattr(db, name), "storageWrite"))
+
+    def snapshot(self) -> dict[tuple[str, str], Histogram]:
+        with self.lock:
+            copies = {}
+            for key, histogram in self.histograms.items():
+                copy = Histogram()
+                copy.counts, copy.sum, copy.count = list(histogram.counts), histogram.sum, histogram.count
+                copies[key] = copy
+            return copies
+
+    def summary(self) -> list[tuple[str, str]]:
+        # one line of text per command, for showing the stats in discord
+        histograms = self.snapshot()
+        lines = []
+        for command in sorted({command for command, _ in histograms}):
+            total = histograms[(command, "total")]
+            breakdown = ", ".join(
+                f"{phase} {histograms[(command, phase)].mean() * 1000:.2f}ms"
+                for phase in phases[1:] if (command, phase) in histograms
+            )
+            lines.append((command, f"{total.count} calls, p50 <= {total.quantile(0.5) * 1000:g}ms, "
+                                   f"p99 <= {total.quantile(0.99) * 1000:g}ms\nmean: {breakdown or 'no phases'}"))
+        return lines
+
+    def toPrometheus(self) -> str:
+        lines = [
+            "# HELP bot_command_phase_seconds Time spent by bot commands, by phase.",
+            "# TYPE bot_command_phase_seconds histogram"
+        ]
+        for (command, phase), histogram in sorted(self.snapshot().items()):
+            labels = f'command="{command}",phase="{phase}"'
+            cumulative = 0
+            for bound, count in zip(bucketBounds, histogram.counts):
+                cumulative += count
+                lines.append(f'bot_command_phase_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'bot_command_phase_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"bot_command_phase_seconds_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"bot_command_phase_seconds_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def writePrometheus(self, path: Path):
+        # written next to the target and renamed over it, so scrapers never read half a file
+        temporaryPath = path.with_suffix(path.suffix + ".tmp")
+        with open(temporaryPath, "w") as file:
+            file.write(self.toPrometheus())
+        os.replace(temporaryPath, path)
+
+    def startExporter(self, path: Path, interval: float = 15.0):
+        def export():
+            while True:
+                time.sleep(interval)
+                self.writePrometheus(path)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.exporter = threading.Thread(target=export, name="metrics-exporter", daemon=True)
+        self.exporter.start()
+
+
+metrics = Metrics()
@@ -0,0 +1,161 @@
+import threading
+from collections import Counter
+from typing import Callable, Iterable
+
+# where a card sits: a deck name, or None for the hand
+Location = str | None
+
+
+class OwnershipIndex:
+    # card id -> who holds it and where; built from every player in the background when the database opens,
+    # and then kept up to date by diffing each player against what was indexed for them when they are saved
+    def __init__(self, loadPlayers: Callable[[], Iterable]):
+        self.loadPlayers = loadPlayers
+        # held by builds and queries; saves never wait for it, so a long build can't hold up the event loop
+        self.lock = threading.Lock()
+        self.built = False
+        self.holdings: dict[int, dict[tuple[int, Location], int]] = {}  # card id -> (player id, location) -> count
+        self.totals: Counter = Counter()
+        self.players: dict[int, dict[Location, Counter]] = {}  # player id -> location -> card counts
+        # player id -> deck name -> (encoded cards, their counts); a save reuses the counts of decks that didn't
+        # change, and adds the changes of decks loaded from what was indexed, so only new decks are counted in full
+        self.deckCounts: dict[int, dict[str, tuple[str, Counter]]] = {}
+        self.usernames: dict[int, str] = {}
+        # saved players waiting to be applied, in the order they were saved
+        self.pendingLock = threading.Lock()
+        self.pending: list[tuple[int, str, dict[Location, Counter], dict[str, tuple[str, Counter]]]] = []
+        self.builder: threading.Thread | None = None
+
+    def build(self):
+        # called with the lock held; saves made meanwhile are queued and applied on top
+        self.holdings.clear()
+        self.totals.clear()
+        self.players.clear()
+        self.deckCounts.clear()
+        self.usernames.clear()
+        for player in self.loadPlayers():
+            self.apply(*self.entryOf(player))
+        self.built = True
+        self.applyPending()
+
+    def ensureBuilt(self):
+        if not self.built:
+            self.build()
+        self.applyPending()
+
+    def buildInBackground(self):
+        def build():
+            with self.lock:
+                self.ensureBuilt()
+
+        self.builder = threading.Thread(target=build, name="ownership-index", daemon=True)
+        self.builder.start()
+
+    def entryOf(self, player) -> tuple[int, str, dict[Location, Counter], dict[str, tuple[str, Counter]]]:
+        # runs without the lock; deckCounts is only ever replaced per player, so this sees a consistent copy
+        counted = self.deckCounts.get(player.id, {})
+        locations = {None: Counter(player.hand)}
+        deckCounts = {}
+        for deck in player.decks.values():
+            encoded, counts = counted.get(deck.name, (None, None))
+            if encoded is None or (deck.encoded != encoded and deck.storedEncoding != encoded):
+                counts = Counter(deck.cards)
+            elif deck.encoded != encoded and deck.changes:
+                counts = counts.copy()
+                for cardId, change in deck.changes.items():
+                    counts[cardId] += change
+                    if counts[cardId] <= 0:
+                        del counts[cardId]
+            locations[deck.name] = counts
+            if deck.encoded is not None:
+                deckCounts[deck.name] = (deck.encoded, counts)
+        return player.id, player.username, locations, deckCounts
+
+    def apply(self, playerId: int, username: str, locations: dict[Location, Counter],
+              deckCounts: dict[str, tuple[str, Counter]]):
+        previous = self.players.get(playerId, {})
+        for location in previous.keys() | locations.keys():
+            before = previous.get(location, Counter())
+            after = locations.get(location, Counter())
+            if before is after or before == after:
+                continue
+            for cardId in before.keys() | after.keys():
+                change = after[cardId] - before[cardId]
+                if change:
+                    self.adjust(cardId, (playerId, location), change)
+        self.players[playerId] = locations
+        self.deckCounts[playerId] = deckCounts
+        self.usernames[playerId] = username
+
+    def applyPending(self):
+        # called with the lock held
+        with self.pendingLock:
+            pending, self.pending = self.pending, []
+        for entry in pending:
+            self.apply(*entry)
+
+    def adjust(self, cardId: int, key: tuple[int, Location], change: int):
+        holders = self.holdings.setdefault(cardId, {})
+        count = holders.get(key, 0) + change
+        if count:
+            holders[key] = count
+        else:
+            holders.pop(key, None)
+            if not holders:
+                del self.holdings[cardId]
+        self.totals[cardId] += change
+        if not self.totals[cardId]:
+            del self.totals[cardId]
+
+    def update(self, player):
+        # the player's cards are counted now, and applied right away unless a build or query holds the index,
+        # in which case that build or the next query picks them up
+        entry = self.entryOf(player)
+        with self.pendingLock:
+            self.pending.append(entry)
+        if self.lock.acquire(blocking=False):
+            try:
+                if self.built:
+                    self.applyPending()
+            finally:
+                self.lock.release()
+
+    def reset(self):
+        with self.lock:
+            self.built = False
+            self.holdings.clear()
+            self.totals.clear()
+            self.players.clear()
+            self.deckCounts.clear()
+            self.usernames.clear()
+            with self.pendingLock:
+                self.pending.clear()
+
+    def owners(self, cardId: int) -> list[tuple[str, int]]:
+        # (username, copies) of everyone holding the card, most copies first
+        with self.lock:
+            self.ensureBuilt()
+            perPlayer = Counter()
+            for (playerId, _), count in self.holdings.get(cardId, {}).items():
+                perPlayer[playerId] += count
+            return [(self.usernames[playerId], count) for playerId, count in perPlayer.most_common()]
+
+    def copies(self, cardId: int) -> tuple[int, int, int]:
+        # copies in circulation: in total, in hands and in decks
+        with self.lock:
+            self.ensureBuilt()
+            inHands = sum(count for (_, location), count in self.holdings.get(cardId, {}).items() if location is None)
+            return self.totals[cardId], inHands, self.totals[cardId] - inHands
+
+    def decksBuiltAround(self, cardId: int, limit: int = 25) -> list[tuple[str, str, int, float]]:
+        # (username, deck, copies, share of the deck) for the decks where the card makes up the most of the deck
+        with self.lock:
+            self.ensureBuilt()
+            decks = []
+            for (playerId, location), count in self.holdings.get(cardId, {}).items():
+                if location is None:
+                    continue
+                size = sum(self.players[playerId][location].values())
+                decks.append((self.usernames[playerId], location, count, count / size))
+            decks.sort(key=lambda deck: (deck[3], deck[2]), reverse=True)
+            return decks[:limit]
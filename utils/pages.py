@@ -0,0 +1,101 @@
+import threading
+
+import discord
+
+from utils.catalog import CardCatalog
+
+# discord refuses embeds with more than 25 fields, field values longer than 1024 characters, or more than
+# 6000 characters in all
+maxFields = 25
+maxFieldValue = 1024
+maxEmbedLength = 6000
+# room kept for the "Page n/m" footer
+footerLength = 32
+
+
+def truncate(value, limit: int = maxFieldValue) -> str:
+    value = str(value)
+    return value if len(value) <= limit else value[:limit - 1] + "…"
+
+
+def pagedEmbeds(title: str, fields: list[tuple[str, object]], pageSize: int = 10, description: str = "",
+                color: int = 0x79e4ff) -> list[discord.Embed]:
+    # a page ends after pageSize fields, or sooner if the next field would take it past maxEmbedLength
+    pageSize = min(pageSize, maxFields)
+    baseLength = len(title) + len(description) + footerLength
+    chunks = [[]]
+    length = baseLength
+    for name, value in fields:
+        name, value = truncate(name, 256), truncate(value)
+        if chunks[-1] and (len(chunks[-1]) == pageSize or length + len(name) + len(value) > maxEmbedLength):
+            chunks.append([])
+            length = baseLength
+        chunks[-1].append((name, value))
+        length += len(name) + len(value)
+    pages = []
+    for number, chunk in enumerate(chunks, start=1):
+        embed = discord.Embed(title=title, description=description, color=color)
+        for name, value in chunk:
+            embed.add_field(name=name, value=value, inline=False)
+        if len(chunks) > 1:
+            embed.set_footer(text=f"Page {number}/{len(chunks)}")
+        pages.append(embed)
+    return pages
+
+
+class CardPages:
+    # the card list embeds are built once per catalog version and shared by every showAllCards call
+    def __init__(self, catalog: CardCatalog, pageSize: int = 10):
+        self.catalog = catalog
+        self.pageSize = pageSize
+        self.lock = threading.Lock()
+        self.pages: list[discord.Embed] = []
+        self.version = None
+
+    def get(self) -> list[discord.Embed]:
+        self.catalog.refresh()
+        with self.lock:
+            if self.version != self.catalog.version:
+                version = self.catalog.version
+                fields = [(card.name, card.props) for card in self.catalog.all()]
+                self.pages = pagedEmbeds("All available cards!", fields, self.pageSize)
+                self.version = version
+            return self.pages
+
+
+class PageView(discord.ui.View):
+    def __init__(self, pages: list[discord.Embed], ownerId: int, timeout: float = 180.0):
+        super().__init__(timeout=timeout)
+        self.pages = pages
+        self.ownerId = ownerId
+        self.index = 0
+        self.updateButtons()
+
+    def updateButtons(self):
+        self.previous.disabled = self.index == 0
+        self.next.disabled = self.index == len(self.pages) - 1
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # only whoever ran the command turns its pages
+        return interaction.user.id == self.ownerId
+
+    async def turn(self, interaction: discord.Interaction, step: int):
+        self.index = max(0, min(self.index + step, len(self.pages) - 1))
+        self.updateButtons()
+        await interaction.response.edit_message(embed=self.pages[self.index], view=self)
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.turn(interaction, -1)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.turn(interaction, 1)
+
+
+async def sendPages(ctx, pages: list[discord.Embed], ownerId: int):
+    # a single page is sent as is, without buttons
+    if len(pages) == 1:
+        await ctx.send(embed=pages[0])
+    else:
+        await ctx.send(embed=pages[0], view=PageView(pages, ownerId))
@@ -0,0 +1,154 @@
+import asyncio
+import contextvars
+import functools
+import time
+from typing import Callable
+
+from utils.db import Database
+
+# the guild the running command was sent from; None outside guilds, such as in direct messages
+currentGuild: contextvars.ContextVar[int | None] = contextvars.ContextVar("guild", default=None)
+
+
+def guildOf(source) -> int | None:
+    # works for commands.Context, discord.Interaction and discord.Message alike
+    guild = getattr(source, "guild", None)
+    return guild.id if guild is not None else None
+
+
+def guildScoped(function):
+    # wraps a command handler; the storage calls it makes go to the partition of the guild it was sent from,
+    # which is opened off the event loop before the handler runs and kept open until it returns
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        guildId = guildOf(args[0]) if args else None
+        partitions = GuildPartitions.active if guildId is not None else None
+        if partitions is not None:
+            await partitions.acquire(guildId)
+        token = currentGuild.set(guildId)
+        try:
+            return await function(*args, **kwargs)
+        finally:
+            currentGuild.reset(token)
+            if partitions is not None:
+                partitions.release(guildId)
+
+    return wrapper
+
+
+class GuildPartitions:
+    # guild id -> a Database of its own under data/guilds/<id>, with its own storage, caches, locks and group
+    # commits; partitions are opened on first use and closed once idle. Players outside any guild, and the
+    # card catalog every partition shares, stay in the database under data/.
+    # Any other attribute is looked up on the partition of the running command, so handlers use this like
+    # a Database.
+
+    # the partitions guildScoped handlers open; the newest one wins
+    active: "GuildPartitions | None" = None
+
+    def __init__(self, path: str, idleTimeout: float = 600.0, **options):
+        self.path = path
+        self.idleTimeout = idleTimeout
+        self.options = options
+        self.openCallbacks: list[Callable[[Database], None]] = []
+        self.partitions: dict[int, Database] = {}
+        self.lastUsed: dict[int, float] = {}
+        # commands running in each open partition, and a lock per guild held while it is opened or closed
+        self.users: dict[int, int] = {}
+        self.openLocks: dict[int, asyncio.Lock] = {}
+        self.evictor: asyncio.Task | None = None
+        self.home = Database(path, **options)
+        self.guildsFolderPath = self.home.playersFolderPath / "guilds"
+        GuildPartitions.active = self
+
+    def __getattr__(self, name: str):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.current(), name)
+
+    def current(self) -> Database:
+        guildId = currentGuild.get()
+        return self.home if guildId is None else self.partition(guildId)
+
+    def openPartition(self, guildId: int) -> Database:
+        # loads the guild's players, so it runs in the executor when commands open it
+        database = Database(
+            self.path, dataFolder=self.guildsFolderPath / str(guildId), catalog=self.home.catalog, **self.options
+        )
+        for callback in self.openCallbacks:
+            callback(database)
+        return database
+
+    def partition(self, guildId: int) -> Database:
+        # commands find their partition already opened by acquire; this only opens one itself for callers
+        # outside commands, such as tools and tests
+        database = self.partitions.get(guildId)
+        if database is None:
+            database = self.partitions[guildId] = self.openPartition(guildId)
+        self.lastUsed[guildId] = time.monotonic()
+        return database
+
+    async def acquire(self, guildId: int) -> Database:
+        lock = self.openLocks.setdefault(guildId, asyncio.Lock())
+        async with lock:
+            database = self.partitions.get(guildId)
+            if database is None:
+                database = await self.home.runInExecutor(self.openPartition, guildId)
+                self.partitions[guildId] = database
+        self.users[guildId] = self.users.get(guildId, 0) + 1
+        self.lastUsed[guildId] = time.monotonic()
+        return database
+
+    def release(self, guildId: int):
+        self.users[guildId] -= 1
+        if not self.users[guildId]:
+            del self.users[guildId]
+        self.lastUsed[guildId] = time.monotonic()
+
+    def whenOpened(self, callback: Callable[[Database], None]):
+        # called for every database, open now or later
+        self.openCallbacks.append(callback)
+        for database in [self.home, *self.partitions.values()]:
+            callback(database)
+
+    async def evictIdle(self) -> list[int]:
+        # a partition is closed under its guild's lock, so a command for that guild waits and then opens it
+        # afresh instead of sharing files with the database being closed
+        now = time.monotonic()
+        evicted = []
+        for guildId in list(self.partitions):
+            if guildId in self.users or now - self.lastUsed[guildId] < self.idleTimeout:
+                continue
+            async with self.openLocks.setdefault(guildId, asyncio.Lock()):
+                database = self.partitions.get(guildId)
+                if database is None or guildId in self.users or not database.isIdle():
+                    continue
+                del self.partitions[guildId]
+                del self.lastUsed[guildId]
+                await database.runInExecutor(database.close)
+                evicted.append(guildId)
+        return evicted
+
+    def startEvictor(self, interval: float = 60.0):
+        # needs the running event loop, so it is started once the bot is ready
+        async def evict():
+            while True:
+                await asyncio.sleep(interval)
+                await self.evictIdle()
+
+        if self.evictor is None or self.evictor.done():
+            self.evictor = asyncio.get_running_loop().create_task(evict())
+
+    def flush(self):
+        for database in [self.home, *self.partitions.values()]:
+            database.flush()
+
+    def close(self):
+        if self.evictor is not None:
+            self.evictor.cancel()
+        for database in [*self.partitions.values(), self.home]:
+            database.close()
+        self.partitions.clear()
+        self.lastUsed.clear()
+        if GuildPartitions.active is self:
+            GuildPartitions.active = None
@@ -0,0 +1,85 @@
+import bisect
+import threading
+from collections import Counter
+
+from utils.catalog import CardCatalog
+
+
+def trigrams(text: str) -> set[str]:
+    # padded, so that short names and word starts still produce trigrams
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CardSearchIndex:
+    def __init__(self, catalog: CardCatalog):
+        self.catalog = catalog
+        self.lock = threading.Lock()
+        self.names: dict[str, str] = {}  # lowercase name -> card name
+        self.sortedNames: list[str] = []
+        self.postings: dict[str, set[str]] = {}
+        self.version = None
+        self.sync()
+
+    def sync(self):
+        # only the cards that were added or removed since the last sync are (re)indexed
+        self.catalog.refresh()
+        if self.version == self.catalog.version:
+            return
+        with self.lock:
+            version = self.catalog.version
+            current = {name.lower(): name for name in self.catalog.cards}
+            for lowerName in self.names.keys() - current.keys():
+                self.remove(lowerName)
+            for lowerName in current.keys() - self.names.keys():
+                self.add(lowerName, current[lowerName])
+            for lowerName, name in current.items():
+                self.names[lowerName] = name
+            self.version = version
+
+    def add(self, lowerName: str, name: str):
+        self.names[lowerName] = name
+        bisect.insort(self.sortedNames, lowerName)
+        for trigram in trigrams(lowerName):
+            self.postings.setdefault(trigram, set()).add(lowerName)
+
+    def remove(self, lowerName: str):
+        del self.names[lowerName]
+        del self.sortedNames[bisect.bisect_left(self.sortedNames, lowerName)]
+        for trigram in trigrams(lowerName):
+            posting = self.postings.get(trigram)
+            if posting is not None:
+                posting.discard(lowerName)
+                if not posting:
+                    del self.postings[trigram]
+
+    def prefixMatches(self, prefix: str, limit: int) -> list[str]:
+        start = bisect.bisect_left(self.sortedNames, prefix)
+        matches = []
+        for lowerName in self.sortedNames[start:start + limit]:
+            if not lowerName.startswith(prefix):
+                break
+            matches.append(lowerName)
+        return matches
+
+    def search(self, query: str, limit: int = 25) -> list[str]:
+        self.sync()
+        query = query.strip().lower()
+        if not query:
+            return [self.names[lowerName] for lowerName in self.sortedNames[:limit]]
+        # names starting with the query come first, then the closest ones by shared trigrams
+        matches = self.prefixMatches(query, limit)
+        if len(matches) < limit:
+            queryTrigrams = trigrams(query)
+            scores = Counter()
+            for trigram in queryTrigrams:
+                scores.update(self.postings.get(trigram, ()))
+            # ignore names that share less than half of the query's trigrams
+            minimumScore = max(1, len(queryTrigrams) // 2)
+            seen = set(matches)
+            for lowerName, score in scores.most_common(limit + len(seen)):
+                if len(matches) >= limit or score < minimumScore:
+                    break
+                if lowerName not in seen:
+                    matches.append(lowerName)
+        return [self.names[lowerName] for lowerName in matches]
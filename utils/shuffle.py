@@ -0,0 +1,100 @@
+import hashlib
+import random
+import secrets
+import threading
+from array import array
+from pathlib import Path
+
+from utils import codec
+from utils.Deck import Deck
+from utils.storage import JsonStorage
+
+# numpy sorts a batch of decks in one vectorized call; without it every deck is sorted on its own
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+modes = ("lazy", "off")
+
+
+def deriveSeed(*parts) -> int:
+    # a stable 64-bit seed from any mix of ints and strings, the same on every machine and python version
+    return int.from_bytes(hashlib.sha256(":".join(map(str, parts)).encode()).digest()[:8], "little")
+
+
+class ShuffleEngine:
+    # every game has a seed, kept in data/shuffle.json; each draw gets its own random stream derived from
+    # (game seed, player id, the player's draw count), so any draw can be recomputed from the logs and replayed
+    def __init__(self, path: Path, mode: str = "lazy", seed: int | None = None):
+        if mode not in modes:
+            raise ValueError(f"Unknown shuffle mode {mode}, expected one of {', '.join(modes)}")
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.seed, self.game = self.load(seed)
+
+    def load(self, seed: int | None) -> tuple[int, int]:
+        # a missing or unreadable state file starts a new game rather than keeping the bot from starting
+        try:
+            with open(self.path, "r") as file:
+                state = codec.load(file)
+            if seed is None or seed == state["seed"]:
+                return int(state["seed"]), int(state["game"])
+        except (OSError, codec.DecodeError, KeyError, TypeError, ValueError):
+            pass
+        seed = secrets.randbits(63) if seed is None else seed
+        self.save(seed, 1)
+        return seed, 1
+
+    def save(self, seed: int, game: int):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        JsonStorage.writeDurably(self.path, codec.dumps({"seed": seed, "game": game}, pretty=True))
+
+    def newGame(self, seed: int | None = None) -> int:
+        with self.lock:
+            self.seed = secrets.randbits(63) if seed is None else seed
+            self.game += 1
+            self.save(self.seed, self.game)
+            return self.seed
+
+    def streamFor(self, player) -> random.Random | None:
+        # advances the player's draw count, which is saved with the player; None draws in insertion order
+        if self.mode == "off":
+            return None
+        player.draws += 1
+        return random.Random(deriveSeed(self.seed, player.id, player.draws))
+
+    def shuffleDecks(self, decks: list[Deck], seed: int):
+        # every card gets a random 32-bit key from one stream seeded by `seed`, and every deck is sorted by its
+        # keys; numpy only does the sorting, so the same seed gives the same order with or without it
+        decks = [deck for deck in decks if len(deck) > 1]
+        if not decks:
+            return
+        lengths = [len(deck) for deck in decks]
+        keyBytes = random.Random(seed).randbytes(4 * sum(lengths))
+        if numpy is None:
+            keys = memoryview(keyBytes).cast("I")
+            start = 0
+            for deck, length in zip(decks, lengths):
+                cards, deckKeys = deck.cards, keys[start:start + length]
+                self.replaceCards(deck, array("H", [cards[i] for i in sorted(range(length), key=deckKeys.__getitem__)]))
+                start += length
+            return
+        # all decks go into one array and are sorted by (deck, key) packed into one integer, which permutes every
+        # deck independently in a single stable sort, the same order sorted() gives
+        cards = numpy.frombuffer(b"".join(deck.cards.tobytes() for deck in decks), dtype=numpy.uint16)
+        owners = numpy.repeat(numpy.arange(len(decks), dtype=numpy.uint64), lengths)
+        keys = numpy.frombuffer(keyBytes, dtype=numpy.uint32)
+        order = numpy.argsort((owners << numpy.uint64(32)) | keys, kind="stable")
+        shuffled = array("H", cards[order].tobytes())
+        start = 0
+        for deck, length in zip(decks, lengths):
+            self.replaceCards(deck, shuffled[start:start + length])
+            start += length
+
+    @staticmethod
+    def replaceCards(deck: Deck, cards: array):
+        deck.cardIds = cards
+        deck.head = 0
+        deck.encoded = None
@@ -0,0 +1,532 @@
+import atexit
+import hashlib
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+from utils import codec
+from utils.Deck import cardObject
+
+
+def nameKey(username: str) -> str:
+    # how usernames are compared when looking players up by name
+    return username.strip().casefold()
+
+
+class JsonStorage:
+    def __init__(self, playersFilePath: Path, cardsFilePath: Path, flushInterval: float = 5.0):
+        self.playersFilePath = playersFilePath
+        self.cardsFilePath = cardsFilePath
+        self.flushInterval = flushInterval
+        self.cardsMtime = None
+        self.cardsDigest = None
+
+        # players are kept in memory, keyed by id, and written back by a background thread; commits are
+        # appended to a journal first, which is replayed on startup and dropped once a flush has them on disk
+        self.journalPath = playersFilePath.with_suffix(".journal")
+        self.oldJournalPath = playersFilePath.with_suffix(".journal.old")
+        self.lock = threading.RLock()
+        self.writeLock = threading.Lock()
+        self.journalLock = threading.Lock()
+        self.players: dict[int, dict] = self.loadPlayers()
+        self.dirty: set[int] = set()
+        # normalized username -> ids of the players with that name, kept in step with self.players
+        self.names: dict[str, set[int]] = {}
+        for record in self.players.values():
+            self.names.setdefault(nameKey(record["username"]), set()).add(record["id"])
+        self.replayJournal()
+        self.journal = open(self.journalPath, "a")
+        self.closed = threading.Event()
+        self.flushThread = threading.Thread(target=self.flushLoop, name="db-flush", daemon=True)
+        self.flushThread.start()
+        atexit.register(self.close)
+
+    def loadPlayers(self) -> dict[int, dict]:
+        with open(self.playersFilePath, "r") as file:
+            return {player["id"]: player for player in codec.decode(file.read(), "players")["players"]}
+
+    def replayJournal(self):
+        for journalPath in (self.oldJournalPath, self.journalPath):
+            if not journalPath.exists():
+                continue
+            with open(journalPath, "r") as file:
+                for line in file:
+                    try:
+                        record = codec.decode(line, "player")
+                    except codec.DecodeError:
+                        break  # the last commit was cut off before it was acknowledged
+                    self.putRecord(record)
+
+    def putRecord(self, record: dict):
+        # called with the lock held
+        previous = self.players.get(record["id"])
+        if previous is not None and previous["username"] != record["username"]:
+            ids = self.names.get(nameKey(previous["username"]))
+            if ids is not None:
+                ids.discard(record["id"])
+                if not ids:
+                    del self.names[nameKey(previous["username"])]
+        self.names.setdefault(nameKey(record["username"]), set()).add(record["id"])
+        self.players[record["id"]] = record
+        self.dirty.add(record["id"])
+
+    def getPlayers(self) -> list[dict]:
+        with self.lock:
+            return list(self.players.values())
+
+    def iterPlayers(self) -> Iterator[dict]:
+        return iter(self.getPlayers())
+
+    def playerIds(self) -> list[int]:
+        with self.lock:
+            return list(self.players)
+
+    def getPlayer(self, playerId: int) -> dict | None:
+        with self.lock:
+            return self.players.get(playerId)
+
+    def getPlayerFromName(self, playerName: str) -> dict | None:
+        with self.lock:
+            ids = self.names.get(nameKey(playerName))
+            # the oldest player wins if two players share a name
+            return self.players[min(ids)] if ids else None
+
+    def insertPlayer(self, record: dict):
+        with self.lock:
+            self.putRecord(record)
+
+    def updatePlayer(self, record: dict):
+        with self.lock:
+            if record["id"] in self.players:
+                self.putRecord(record)
+
+    def commit(self, records: list[dict]):
+        # durable once this returns: the records are in the journal, with a single fsync for all of them
+        lines = "".join(codec.dumps(record) + "\n" for record in records)
+        with self.journalLock:
+            self.journal.write(lines)
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+            with self.lock:
+                for record in records:
+                    self.putRecord(record)
+
+    def getCards(self) -> list[cardObject]:
+        with open(self.cardsFilePath, "r") as file:
+            return codec.decode(file.read(), "cards")["cards"]
+
+    def cardsVersion(self) -> str:
+        # the file is only hashed again when its mtime changes, so touching it doesn't count as a change
+        mtime = os.stat(self.cardsFilePath).st_mtime_ns
+        if mtime != self.cardsMtime:
+            with open(self.cardsFilePath, "rb") as file:
+                self.cardsDigest = hashlib.sha1(file.read()).hexdigest()
+            self.cardsMtime = mtime
+        return self.cardsDigest
+
+    def saveCards(self, cards: list[cardObject]):
+        with open(self.cardsFilePath, "w") as file:
+            # cards.json is edited by hand, so it is the one file kept readable
+            file.write(codec.dumps({"cards": cards}, pretty=True))
+
+    @staticmethod
+    def writeDurably(path: Path, data: str):
+        # written next to the target, synced and renamed over it, so a crash leaves either version intact
+        temporaryPath = path.with_suffix(path.suffix + ".tmp")
+        with open(temporaryPath, "w") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporaryPath, path)
+
+    def rotateJournal(self):
+        # called with both locks held; whatever was committed so far is in the snapshot being flushed
+        self.journal.close()
+        try:
+            if self.oldJournalPath.exists():
+                with open(self.journalPath, "r") as source, open(self.oldJournalPath, "a") as target:
+                    shutil.copyfileobj(source, target)
+                os.remove(self.journalPath)
+            elif self.journalPath.exists():
+                os.replace(self.journalPath, self.oldJournalPath)
+        finally:
+            self.journal = open(self.journalPath, "a")
+
+    def takeSnapshot(self):
+        return codec.dumps({"players": list(self.players.values())})
+
+    def writeSnapshot(self, snapshot):
+        self.writeDurably(self.playersFilePath, snapshot)
+
+    def flush(self):
+        # the writeLock keeps two flushes from interleaving their writes, while the
+        # other locks are only held long enough to take a snapshot
+        with self.writeLock:
+            with self.journalLock, self.lock:
+                if not self.dirty:
+                    return
+                snapshot = self.takeSnapshot()
+                flushed, self.dirty = self.dirty, set()
+                try:
+                    self.rotateJournal()
+                except Exception:
+                    self.dirty |= flushed
+                    raise
+            try:
+                self.writeSnapshot(snapshot)
+            except Exception:
+                # the old journal is kept, and the players are marked dirty again, so the next flush writes
+                # them before it drops the journal
+                with self.lock:
+                    self.dirty |= flushed
+                raise
+            self.oldJournalPath.unlink(missing_ok=True)
+
+    def flushLoop(self):
+        # a failed flush is reported and tried again on the next round, so persistence outlives a full disk
+        while not self.closed.wait(self.flushInterval):
+            try:
+                self.flush()
+            except Exception:
+                print("Could not flush the players, retrying:", file=sys.stderr)
+                traceback.print_exc()
+
+    def clear(self):
+        with self.journalLock, self.lock:
+            self.players.clear()
+            self.names.clear()
+            self.dirty.clear()
+            self.journal.truncate(0)
+            self.oldJournalPath.unlink(missing_ok=True)
+
+    def close(self):
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        self.flushThread.join()
+        self.flush()
+        self.journal.close()
+        atexit.unregister(self.close)
+
+
+class ShardedStorage(JsonStorage):
+    # every player is kept in its own file, data/players/<bucket>/<id>.json, so saving a player only
+    # rewrites that player's file; the bucket spreads the files over 256 directories
+    importedMarker = ".imported"
+
+    def __init__(self, shardsFolderPath: Path, playersFilePath: Path, cardsFilePath: Path,
+                 flushInterval: float = 5.0, loadWorkers: int = 8):
+        self.shardsFolderPath = shardsFolderPath
+        self.loadWorkers = loadWorkers
+        super().__init__(playersFilePath, cardsFilePath, flushInterval)
+
+    @staticmethod
+    def bucket(playerId: int) -> str:
+        return hashlib.sha1(str(playerId).encode()).hexdigest()[:2]
+
+    def shardPath(self, playerId: int) -> Path:
+        return self.shardsFolderPath / self.bucket(playerId) / f"{playerId}.json"
+
+    @staticmethod
+    def readBucket(bucketPath: Path) -> list[dict]:
+        records = []
+        for shardPath in bucketPath.glob("*.json"):
+            with open(shardPath, "r") as file:
+                records.append(codec.decode(file.read(), "player"))
+        return records
+
+    def loadPlayers(self) -> dict[int, dict]:
+        self.shardsFolderPath.mkdir(parents=True, exist_ok=True)
+        if not (self.shardsFolderPath / self.importedMarker).exists():
+            self.importFromJson()
+        buckets = [path for path in self.shardsFolderPath.iterdir() if path.is_dir()]
+        with ThreadPoolExecutor(max_workers=self.loadWorkers, thread_name_prefix="shard-load") as executor:
+            return {record["id"]: record for records in executor.map(self.readBucket, buckets) for record in records}
+
+    def importFromJson(self):
+        # one-time import of the players.json file used by the json backend
+        with open(self.playersFilePath, "r") as file:
+            for record in codec.decode(file.read(), "players")["players"]:
+                self.writeShard(record)
+        (self.shardsFolderPath / self.importedMarker).touch()
+
+    def writeShard(self, record: dict):
+        shardPath = self.shardPath(record["id"])
+        shardPath.parent.mkdir(exist_ok=True)
+        self.writeDurably(shardPath, codec.dumps(record))
+
+    def takeSnapshot(self):
+        return [self.players[playerId] for playerId in self.dirty]
+
+    def writeSnapshot(self, snapshot):
+        for record in snapshot:
+            self.writeShard(record)
+
+
+class SqliteStorage:
+    schema = """
+        CREATE TABLE IF NOT EXISTS players (
+            id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL,
+            activeDeck TEXT,
+            hand TEXT
+        );
+        CREATE INDEX IF NOT EXISTS playersUsername ON players (username);
+        CREATE TABLE IF NOT EXISTS decks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            playerId INTEGER NOT NULL REFERENCES players (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            name TEXT,
+            cards TEXT
+        );
+        CREATE INDEX IF NOT EXISTS decksPlayerName ON decks (playerId, name);
+        CREATE INDEX IF NOT EXISTS decksPlayerPosition ON decks (playerId, position);
+        -- deckCards and handEntries hold the card names of databases created before card ids existed
+        CREATE TABLE IF NOT EXISTS deckCards (
+            deckId INTEGER NOT NULL REFERENCES decks (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            cardName TEXT NOT NULL,
+            PRIMARY KEY (deckId, position)
+        );
+        CREATE TABLE IF NOT EXISTS handEntries (
+            playerId INTEGER NOT NULL REFERENCES players (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            cardName TEXT NOT NULL,
+            PRIMARY KEY (playerId, position)
+        );
+        CREATE TABLE IF NOT EXISTS cards (
+            name TEXT PRIMARY KEY,
+            position INTEGER NOT NULL,
+            link TEXT NOT NULL,
+            props TEXT NOT NULL,
+            id INTEGER,
+            retired INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+    addedColumns = [
+        ("players", "hand", "TEXT"),
+        ("players", "usernameKey", "TEXT"),
+        ("players", "draws", "INTEGER NOT NULL DEFAULT 0"),
+        ("decks", "cards", "TEXT"),
+        ("cards", "id", "INTEGER"),
+        ("cards", "retired", "INTEGER NOT NULL DEFAULT 0")
+    ]
+
+    def __init__(self, databaseFilePath: Path, playersFilePath: Path, cardsFilePath: Path):
+        self.databaseFilePath = databaseFilePath
+        self.playersFilePath = playersFilePath
+        self.cardsFilePath = cardsFilePath
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(databaseFilePath, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(self.schema)
+        self.addMissingColumns()
+        self.addUsernameKeys()
+        self.importFromJson()
+        # the cards version is checked from the event loop, so it is read on a connection of its own that player
+        # reads and writes never hold
+        self.versionLock = threading.Lock()
+        self.versionConnection = self.openReader()
+
+    def openReader(self) -> sqlite3.Connection:
+        # a read-only connection; in WAL mode it reads a snapshot of its own while writers go on
+        return sqlite3.connect(f"{self.databaseFilePath.resolve().as_uri()}?mode=ro", uri=True,
+                               check_same_thread=False, isolation_level=None)
+
+    def addMissingColumns(self):
+        with self.lock, self.connection:
+            for table, column, declaration in self.addedColumns:
+                columns = [c[1] for c in self.connection.execute(f"PRAGMA table_info({table})")]
+                if column not in columns:
+                    self.connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+    def addUsernameKeys(self):
+        # fills the normalized names of players stored before usernameKey existed, then indexes them
+        with self.lock, self.connection:
+            rows = self.connection.execute("SELECT id, username FROM players WHERE usernameKey IS NULL").fetchall()
+            self.connection.executemany(
+                "UPDATE players SET usernameKey = ? WHERE id = ?", [(nameKey(username), i) for i, username in rows]
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS playersUsernameKey ON players (usernameKey)")
+
+    def importFromJson(self):
+        # one-time import of the players.json/cards.json files used by the json backend
+        with self.lock, self.connection:
+            if self.connection.execute("SELECT 1 FROM meta WHERE key = 'imported'").fetchone():
+                return
+            with open(self.playersFilePath, "r") as file:
+                for record in codec.decode(file.read(), "players")["players"]:
+                    self.writePlayer(record)
+            with open(self.cardsFilePath, "r") as file:
+                self.writeCards(codec.decode(file.read(), "cards")["cards"])
+            self.connection.execute("INSERT INTO meta (key, value) VALUES ('imported', '1')")
+
+    @staticmethod
+    def readCards(value: str | None, legacyRows: Callable[[], Iterable]) -> str | list[str]:
+        # encoded card ids, or a list of names for players imported from json or stored before card ids;
+        # the legacy rows are only queried for the latter
+        if value is None:
+            return [c for c, in legacyRows()]
+        if value.startswith("["):
+            return codec.loads(value)
+        return value
+
+    @staticmethod
+    def writeCardsValue(cards: str | list[str]) -> str:
+        return cards if isinstance(cards, str) else codec.dumps(cards)
+
+    def readPlayer(self, row) -> dict:
+        deckRows = self.connection.execute(
+            "SELECT id, name, cards FROM decks WHERE playerId = ? ORDER BY position", (row[0],)).fetchall()
+        return self.recordFromRows(self.connection, row, deckRows)
+
+    def recordFromRows(self, connection: sqlite3.Connection, row, deckRows) -> dict:
+        playerId, username, activeDeck, hand, draws = row
+        decks = []
+        for deckId, name, cards in deckRows:
+            decks.append({"name": name, "cards": self.readCards(cards, lambda: connection.execute(
+                "SELECT cardName FROM deckCards WHERE deckId = ? ORDER BY position", (deckId,)))})
+        hand = self.readCards(hand, lambda: connection.execute(
+            "SELECT cardName FROM handEntries WHERE playerId = ? ORDER BY position", (playerId,)))
+        return {"username": username, "id": playerId, "hand": hand, "decks": decks, "activeDeck": activeDeck,
+                "draws": draws}
+
+    def writePlayer(self, record: dict):
+        # only this player's rows are touched; decks and hand are rewritten as a whole
+        self.connection.execute(
+            "INSERT OR REPLACE INTO players (id, username, usernameKey, activeDeck, hand, draws) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (record["id"], record["username"], nameKey(record["username"]), record["activeDeck"],
+             self.writeCardsValue(record["hand"]), record.get("draws") or 0)
+        )
+        self.connection.execute("DELETE FROM decks WHERE playerId = ?", (record["id"],))
+        self.connection.execute("DELETE FROM handEntries WHERE playerId = ?", (record["id"],))
+        self.connection.executemany(
+            "INSERT INTO decks (playerId, position, name, cards) VALUES (?, ?, ?, ?)",
+            [(record["id"], position, deck["name"], self.writeCardsValue(deck["cards"]))
+             for position, deck in enumerate(record["decks"])]
+        )
+
+    def writeCards(self, cards: list[cardObject]):
+        self.connection.execute("DELETE FROM cards")
+        self.connection.executemany(
+            "INSERT INTO cards (name, position, link, props, id, retired) VALUES (?, ?, ?, ?, ?, ?)",
+            [(card["name"], i, card["link"], codec.dumps(card["props"]), card.get("id"), int(card.get("retired", False)))
+             for i, card in enumerate(cards)]
+        )
+        self.connection.execute(
+            "INSERT INTO meta (key, value) VALUES ('cardsVersion', 1) "
+            "ON CONFLICT (key) DO UPDATE SET value = value + 1"
+        )
+
+    def playerIds(self) -> list[int]:
+        with self.lock:
+            return [playerId for playerId, in self.connection.execute("SELECT id FROM players")]
+
+    def getPlayers(self) -> list[dict]:
+        return list(self.iterPlayers())
+
+    def iterPlayers(self) -> Iterator[dict]:
+        # streamed from a read connection of its own, in one snapshot, so a scan of every player never takes
+        # self.lock; players and decks are both read in player id order and merged, two queries in all
+        connection = self.openReader()
+        try:
+            connection.execute("BEGIN")
+            players = connection.execute("SELECT id, username, activeDeck, hand, draws FROM players ORDER BY id")
+            decks = connection.execute("SELECT playerId, id, name, cards FROM decks ORDER BY playerId, position")
+            deck = next(decks, None)
+            for row in players:
+                deckRows = []
+                while deck is not None and deck[0] <= row[0]:
+                    if deck[0] == row[0]:
+                        deckRows.append(deck[1:])
+                    deck = next(decks, None)
+                yield self.recordFromRows(connection, row, deckRows)
+        finally:
+            connection.close()
+
+    def getPlayer(self, playerId: int) -> dict | None:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT id, username, activeDeck, hand, draws FROM players WHERE id = ?", (playerId,)
+            ).fetchone()
+            return self.readPlayer(row) if row else None
+
+    def getPlayerFromName(self, playerName: str) -> dict | None:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT id, username, activeDeck, hand, draws FROM players WHERE usernameKey = ? ORDER BY id LIMIT 1",
+                (nameKey(playerName),)
+            ).fetchone()
+            return self.readPlayer(row) if row else None
+
+    def insertPlayer(self, record: dict):
+        with self.lock, self.connection:
+            self.writePlayer(record)
+
+    def updatePlayer(self, record: dict):
+        with self.lock, self.connection:
+            if self.connection.execute("SELECT 1 FROM players WHERE id = ?", (record["id"],)).fetchone():
+                self.writePlayer(record)
+
+    def commit(self, records: list[dict]):
+        # one transaction for the whole group, synced to disk when it commits; single writes stay
+        # on synchronous=NORMAL
+        with self.lock:
+            self.connection.execute("PRAGMA synchronous=FULL")
+            try:
+                with self.connection:
+                    for record in records:
+                        self.writePlayer(record)
+            finally:
+                self.connection.execute("PRAGMA synchronous=NORMAL")
+
+    @staticmethod
+    def cardFromRow(row) -> cardObject:
+        name, link, props, cardId, retired = row
+        card = {"id": cardId, "name": name, "link": link, "props": codec.loads(props)}
+        if retired:
+            card["retired"] = True
+        return card
+
+    def getCards(self) -> list[cardObject]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT name, link, props, id, retired FROM cards ORDER BY position"
+            ).fetchall()
+        return [self.cardFromRow(row) for row in rows]
+
+    def cardsVersion(self) -> str:
+        with self.versionLock:
+            row = self.versionConnection.execute("SELECT value FROM meta WHERE key = 'cardsVersion'").fetchone()
+        return row[0] if row else "0"
+
+    def saveCards(self, cards: list[cardObject]):
+        with self.lock, self.connection:
+            self.writeCards(cards)
+
+    def flush(self):
+        pass
+
+    def clear(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM players")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+        with self.versionLock:
+            self.versionConnection.close()
+